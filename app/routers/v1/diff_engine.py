@@ -0,0 +1,78 @@
+from bson.decimal128 import Decimal128
+
+from .normalization import normalize_list, to_display
+
+
+def normalize_value(value):
+    """
+    Convert a field value into the form used for comparison.
+
+    Lists are order-insensitive, so any list that was not already normalized
+    by `normalize_document` is compared in the same canonical form;
+    decimals written by the repair mode are compared as `Decimal`; everything
+    else is compared as is.
+    """
+    if isinstance(value, list):
+        return normalize_list(value)
+    if isinstance(value, Decimal128):
+        return value.to_decimal()
+    return value
+
+
+def diff_fields(mysql_doc, mongo_doc):
+    """
+    Returns:
+        dict: {field: {"mysql": value, "mongo": value}} for every differing field.
+    """
+    differences = {}
+    for key in mysql_doc.keys() | mongo_doc.keys():
+        if key == "_id":
+            continue
+        mysql_value = mysql_doc.get(key)
+        mongo_value = mongo_doc.get(key)
+        if mysql_value == mongo_value:
+            continue
+        if normalize_value(mysql_value) != normalize_value(mongo_value):
+            differences[key] = {
+                "mysql": to_display(mysql_value),
+                "mongo": to_display(mongo_value),
+            }
+    return differences
+
+
+def diff_documents(mysql_data, mongo_data):
+    """
+    Compare MySQL ETL rows and MongoDB documents by `_id`.
+
+    Both sides are expected to have their list fields normalized already
+    (`normalize_document`), so identical documents compare equal as whole
+    dicts in a single C-level `==`; only the documents that differ are
+    compared field by field.
+
+    Args:
+        mysql_data (list[dict]): The expected documents built from MySQL.
+        mongo_data (list[dict]): The documents found in MongoDB.
+
+    Returns:
+        dict: {id: {field: {"mysql": value, "mongo": value}}} for every differing
+              field, and {id: {"existence": {"mysql": bool, "mongo": bool}}} for
+              IDs that only exist on one side.
+    """
+    mysql_map = {obj["_id"]: obj for obj in mysql_data or []}
+    mongo_map = {obj["_id"]: obj for obj in mongo_data or []}
+
+    differences = {}
+    for id_ in mysql_map.keys() ^ mongo_map.keys():
+        differences[id_] = {
+            "existence": {"mysql": id_ in mysql_map, "mongo": id_ in mongo_map}
+        }
+
+    for id_, mysql_doc in mysql_map.items():
+        mongo_doc = mongo_map.get(id_)
+        if mongo_doc is None or mysql_doc == mongo_doc:
+            continue
+        fields = diff_fields(mysql_doc, mongo_doc)
+        if fields:
+            differences[id_] = fields
+
+    return differences
@@ -0,0 +1,73 @@
+import threading
+import time
+
+from loguru import logger
+
+from .mysql_connector import MySQLConnector
+from .sqls import dimension_sqls, dimension_version_sql
+
+
+class DimensionCache:
+    """
+    In-process cache of the rarely changing name tables used by the ETL
+    (`tag_actor`, `tag`, `tag_guest`), as {id: lower-cased name}.
+
+    A table is reloaded when its entry is older than `ttl` seconds, or when
+    its `MAX(last_modified_time)` / row count changed. That version check
+    runs at most once every `check_interval` seconds per table.
+    """
+
+    def __init__(
+        self, mysql_connector: MySQLConnector, ttl=3600, check_interval=60
+    ) -> None:
+        self.mysql_connector = mysql_connector
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def names(self, table_name):
+        """
+        Returns:
+            dict: {id: name} of the given dimension table.
+        """
+        if table_name not in dimension_sqls:
+            raise ValueError(f"Invalid dimension table: {table_name}")
+
+        with self._lock:
+            entry = self._entries.get(table_name)
+            now = time.monotonic()
+            if entry is not None and now - entry["loaded_at"] < self.ttl:
+                if now - entry["checked_at"] < self.check_interval:
+                    return entry["names"]
+                version = self._fetch_version(table_name)
+                entry["checked_at"] = now
+                if version == entry["version"]:
+                    return entry["names"]
+
+            entry = self._load(table_name)
+            self._entries[table_name] = entry
+            return entry["names"]
+
+    def invalidate(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_name, None)
+
+    def _fetch_version(self, table_name):
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(dimension_version_sql.format(table_name))
+            return tuple(cursor.fetchall()[0])
+
+    def _load(self, table_name):
+        # 先取版本再加载，加载期间的修改会在下次检查时触发重新加载
+        version = self._fetch_version(table_name)
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(dimension_sqls[table_name])
+            names = {row[0]: row[1] for row in cursor.fetchall()}
+        logger.info(f"Dimension cache loaded {len(names)} rows from {table_name}")
+
+        now = time.monotonic()
+        return {"names": names, "version": version, "loaded_at": now, "checked_at": now}
@@ -0,0 +1,380 @@
+"""
+Dirty-ID tracking from the MySQL binlog, for targeted re-validation.
+
+A `DirtyIdTracker` consumes row events (inserts, updates and deletes) of the
+tables the search documents are built from and records which series / product
+IDs they touch in a deduplicated dirty set. A validator drains that set in
+batches and compares only those documents, instead of scanning both tables.
+
+Row events are read from one of two sources:
+
+- `BinlogSource`: the MySQL binlog, via the optional `python-mysql-replication`
+  package (`binlog_format=ROW` and `binlog_row_image=FULL` on the server).
+- `ReplaySource`: a local JSONL replay of it, one event per line, e.g.
+  {"table": "series_actor_relation", "rows": [{"series_id": 1, "tag_actor_id": 7}]}
+
+Relation and dimension tables map back to the IDs of the documents they feed
+(e.g. `series_actor_relation` to its `series_id`, `tag_actor` to every series
+with that actor), and a dirty series makes every series of the same
+`ccs_series_id` group dirty, because keywords, actors and alternative names are
+aggregated per group. A `ccs_ott_series_relation` row also marks the rest of
+its (old and new) `ccs_series_id` group dirty: once the row is deleted or moved,
+the group can no longer be found from the series itself.
+
+The binlog position is persisted in the state store once every ID read up to
+it has been validated, so a restart re-reads at most the unvalidated events.
+"""
+
+import itertools
+import json
+import threading
+import time
+
+from loguru import logger
+
+from .metrics import REGISTRY, STAGE_SECONDS, Counter
+from .sqls import (
+    product_ids_by_guest_tag_sql,
+    series_ids_by_actor_sql,
+    series_ids_by_ccs_series_sql,
+    series_ids_by_tag_sql,
+)
+from .utils import backoff_delay
+
+try:
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.row_event import (
+        DeleteRowsEvent,
+        UpdateRowsEvent,
+        WriteRowsEvent,
+    )
+except ImportError:  # optional dependency, only needed for BinlogSource
+    BinLogStreamReader = None
+
+DIRTY_EVENTS = REGISTRY.register(
+    Counter(
+        "validation_dirty_row_events_total",
+        "Binlog row events consumed by the dirty-ID tracker.",
+        ("table",),
+    )
+)
+
+# 文档表：变更行的哪一列是文档ID
+DOCUMENT_COLUMNS = {
+    "series": ("series", "series_id"),
+    "product": ("product", "product_id"),
+    "series_actor_relation": ("series", "series_id"),
+    "series_tag_relation": ("series", "series_id"),
+    "ccs_ott_series_relation": ("series", "series_id"),
+    "product_tag_relation": ("product", "product_id"),
+}
+
+# 维度表：变更行的ID列，以及查询引用它的文档ID的SQL
+DIMENSION_COLUMNS = {
+    "tag_actor": ("series", "tag_actor_id", series_ids_by_actor_sql),
+    "tag": ("series", "tag_id", series_ids_by_tag_sql),
+    "tag_guest": ("product", "tag_guest_id", product_ids_by_guest_tag_sql),
+}
+
+# 分组关系表：变更行的分组ID列，以及查询组内现有文档ID的SQL
+GROUP_COLUMNS = {
+    "ccs_ott_series_relation": ("series", "ccs_series_id", series_ids_by_ccs_series_sql),
+}
+
+# 维度表和分组关系表的ID都在 drain 时才批量映射为文档ID
+REFERENCE_COLUMNS = {**DIMENSION_COLUMNS, **GROUP_COLUMNS}
+
+TRACKED_TABLES = tuple(dict.fromkeys([*DOCUMENT_COLUMNS, *REFERENCE_COLUMNS]))
+
+
+class ReplaySource:
+    """
+    Row events replayed from a JSONL file; the position is the line number.
+    """
+
+    blocking = False
+
+    def __init__(self, path) -> None:
+        self.path = path
+
+    def events(self, position=None):
+        """
+        Yields:
+            tuple: (position after the event, table name, list of row dicts)
+        """
+        skip = position["line"] if position else 0
+        with open(self.path) as file:
+            for line_number, line in enumerate(file, 1):
+                if line_number <= skip or not line.strip():
+                    continue
+                event = json.loads(line)
+                yield {"line": line_number}, event["table"], event["rows"]
+
+    def close(self):
+        pass
+
+
+class BinlogSource:
+    """
+    Row events read from the MySQL binlog as a replica with `server_id`.
+    """
+
+    def __init__(self, mysql_connector, server_id, blocking=True) -> None:
+        if BinLogStreamReader is None:
+            raise RuntimeError(
+                "Binlog tracking requires python-mysql-replication "
+                "(pip install mysql-replication)"
+            )
+        self.mysql_connector = mysql_connector
+        self.server_id = server_id
+        self.blocking = blocking
+        self._stream = None
+
+    def events(self, position=None):
+        connector = self.mysql_connector
+        self._stream = BinLogStreamReader(
+            connection_settings={
+                "host": connector.host,
+                "port": connector.port,
+                "user": connector.user,
+                "passwd": connector.password,
+            },
+            server_id=self.server_id,
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
+            only_schemas=[connector.database],
+            only_tables=list(TRACKED_TABLES),
+            resume_stream=position is not None,
+            log_file=position["log_file"] if position else None,
+            log_pos=position["log_pos"] if position else None,
+            blocking=self.blocking,
+        )
+        for event in self._stream:
+            rows = []
+            for row in event.rows:
+                if isinstance(event, UpdateRowsEvent):
+                    # 关系行改变了所属ID时，新旧ID都受影响
+                    rows.extend((row["before_values"], row["after_values"]))
+                else:
+                    rows.append(row["values"])
+            position = {"log_file": self._stream.log_file, "log_pos": self._stream.log_pos}
+            yield position, event.table, rows
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+
+
+class DirtyIdTracker:
+    """
+    Deduplicated dirty IDs per document table, fed by a row-event source.
+
+    `drain` returns up to `limit` dirty IDs at a time (already expanded to
+    their ccs group for series); call `checkpoint` after they have been
+    validated to persist the source position.
+    """
+
+    def __init__(self, search_engine, source, state_key="binlog_position") -> None:
+        self.search_engine = search_engine
+        self.source = source
+        self.state_store = search_engine.state_store
+        self.state_key = state_key
+        # {表名: {ID: None}}，字典去重并保持加入顺序
+        self._dirty = {table_name: {} for table_name in ("series", "product")}
+        # 维度表ID / 分组ID，drain 时才批量查询映射为文档ID
+        self._dimensions = {table_name: {} for table_name in REFERENCE_COLUMNS}
+        self._draining = 0
+        self._position = self.state_store.get(state_key)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"events": 0, "rows": 0, "drained": 0, "last_event_at": None}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="dirty-id-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        """
+        Consume the source until `stop` is called, reopening it after errors.
+        """
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                for position, table_name, rows in self.source.events(self._position):
+                    self.add_rows(table_name, rows, position)
+                    attempt = 0
+                    if self._stop.is_set():
+                        break
+                else:
+                    # 非阻塞的数据源（回放文件）读完即结束
+                    if not self.source.blocking:
+                        break
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                delay = backoff_delay(attempt)
+                attempt += 1
+                logger.warning(f"Binlog source failed ({e}), reopening in {delay:.1f}s")
+                self._stop.wait(delay)
+        logger.info("dirty-ID tracker stopped")
+
+    def add_rows(self, table_name, rows, position=None):
+        """
+        Mark the documents touched by the changed rows of `table_name` as dirty.
+        """
+        DIRTY_EVENTS.inc(table=table_name)
+        with self._lock:
+            self.stats["events"] += 1
+            self.stats["rows"] += len(rows)
+            self.stats["last_event_at"] = int(time.time())
+            columns = []
+            if table_name in DOCUMENT_COLUMNS:
+                target, column = DOCUMENT_COLUMNS[table_name]
+                columns.append((column, self._dirty[target]))
+            if table_name in REFERENCE_COLUMNS:
+                _, column, _ = REFERENCE_COLUMNS[table_name]
+                columns.append((column, self._dimensions[table_name]))
+
+            for column, pending in columns:
+                for row in rows:
+                    id_ = row.get(column)
+                    if id_ is not None:
+                        pending[id_] = None
+            if position is not None:
+                self._position = position
+
+        # 名称变更后维度缓存需要重新加载
+        dimension_cache = self.search_engine.dimension_cache
+        if table_name in DIMENSION_COLUMNS and dimension_cache is not None:
+            dimension_cache.invalidate(table_name)
+
+    def add(self, table_name, ids):
+        with self._lock:
+            self._dirty[table_name].update(dict.fromkeys(ids))
+
+    def pending(self):
+        with self._lock:
+            counts = {table_name: len(ids) for table_name, ids in self._dirty.items()}
+            counts.update(
+                {table_name: len(ids) for table_name, ids in self._dimensions.items()}
+            )
+        return counts
+
+    def _resolve_dimensions(self):
+        with self._lock:
+            dimensions = {
+                table_name: list(ids) for table_name, ids in self._dimensions.items() if ids
+            }
+        for table_name, ids in dimensions.items():
+            target, _, sql = REFERENCE_COLUMNS[table_name]
+            owners = [
+                row[f"{target}_id"] for row in self.search_engine.iter_etl_query(sql, ids)
+            ]
+            with self._lock:
+                self._dirty[target].update(dict.fromkeys(owners))
+                for id_ in ids:
+                    self._dimensions[table_name].pop(id_, None)
+
+    def drain(self, table_name, limit):
+        """
+        Remove and return up to `limit` dirty IDs of `table_name` (series are
+        returned with the rest of their ccs group).
+        """
+        self._resolve_dimensions()
+        with self._lock:
+            dirty = self._dirty[table_name]
+            ids = list(itertools.islice(dirty, limit))
+            for id_ in ids:
+                del dirty[id_]
+            self._draining += 1
+        try:
+            if table_name == "series" and ids:
+                ids = self.search_engine.expand_ccs_groups(ids)
+                with self._lock:
+                    for id_ in ids:
+                        dirty.pop(id_, None)
+        except BaseException:
+            self.requeue(table_name, ids)
+            raise
+        with self._lock:
+            self.stats["drained"] += len(ids)
+        return ids
+
+    def requeue(self, table_name, ids):
+        """
+        Put drained IDs back, e.g. when validating them failed.
+        """
+        with self._lock:
+            self._dirty[table_name].update(dict.fromkeys(ids))
+            self._draining -= 1
+
+    def checkpoint(self):
+        """
+        Mark the last drained batch as validated and persist the source
+        position once no dirty IDs are left.
+        """
+        with self._lock:
+            self._draining = max(self._draining - 1, 0)
+            clean = (
+                not self._draining
+                and not any(self._dirty.values())
+                and not any(self._dimensions.values())
+            )
+            position = self._position
+        if clean and position is not None and position != self.state_store.get(self.state_key):
+            self.state_store.set(self.state_key, position)
+
+    def validate(self, table_name, batch_size=1000, progress=None):
+        """
+        Drain every dirty ID of `table_name` batch by batch and compare the documents.
+
+        Returns:
+            dict: checked / mismatched counts and the report directory.
+        """
+        checked = 0
+        mismatched = 0
+        with self.search_engine.open_report(table_name, "dirty") as report:
+            while True:
+                ids = self.drain(table_name, batch_size)
+                if not ids:
+                    self.checkpoint()
+                    break
+                try:
+                    with STAGE_SECONDS.time(stage="dirty", table=table_name):
+                        differences = self.search_engine.compare_documents(table_name, ids)
+                except BaseException:
+                    self.requeue(table_name, ids)
+                    raise
+                for id_, diffs in differences.items():
+                    report.write("document_mismatch", id_, differences=diffs)
+                checked += len(ids)
+                mismatched += len(differences)
+                if progress is not None:
+                    progress.last_id = checked
+                    progress.document_mismatches = mismatched
+                self.checkpoint()
+            report.summary.update({"checked": checked, "mismatched": mismatched})
+
+        logger.info(f"{table_name} dirty IDs checked: {checked}, mismatched: {mismatched}")
+        return {"checked": checked, "mismatched": mismatched, "report": report.directory}
+
+    def to_dict(self):
+        return {
+            "running": self.running,
+            "pending": self.pending(),
+            "position": self._position,
+            **self.stats,
+        }
@@ -1,11 +1,20 @@
 import os
+import json
 import asyncio
-from fastapi import APIRouter
-from . import utils
-from .search_engine import SearchEngine
+from fastapi import APIRouter, HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from loguru import logger
+from . import metrics, utils
+from .change_stream_validator import ChangeStreamValidator
+from .dimension_cache import DimensionCache
+from .dirty_tracker import BinlogSource, DirtyIdTracker, ReplaySource
+from .job_manager import JobManager
+from .search_engine import ReconcileMode, SearchEngine
 from .mysql_connector import MySQLConnector
+from .report_writer import read_report_ids
 from enum import Enum
-from typing import Any,Dict
+from typing import Any,Dict,Optional
 from typing import List
 from pydantic import BaseModel
 
@@ -20,12 +29,123 @@ MYSQL_HOST = os.environ["MYSQL_HOST"]
 MYSQL_USER = os.environ["MYSQL_USER"]
 MYSQL_PASSWORD = os.environ["MYSQL_PASSWORD"]
 MYSQL_DB = os.environ["MYSQL_DB"]
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
 MySQLConnector = MySQLConnector(
-    database=MYSQL_DB, host=MYSQL_HOST, user=MYSQL_USER, password=MYSQL_PASSWORD
+    database=MYSQL_DB,
+    host=MYSQL_HOST,
+    user=MYSQL_USER,
+    password=MYSQL_PASSWORD,
+    pool_size=MYSQL_POOL_SIZE,
 )
 
 MONGODB_URL = os.environ["MONGODB_URL"]
-search_engine = SearchEngine(mongodb_url=MONGODB_URL, mysql_connector=MySQLConnector)
+# 并行模式的进程数，未设置时使用CPU核数
+PARALLEL_WORKERS = int(os.getenv("PARALLEL_WORKERS", "0")) or None
+# MongoDB 扫描游标每批拉取的文档数
+MONGO_BATCH_SIZE = int(os.getenv("MONGO_BATCH_SIZE", "20000"))
+# 修复模式每批写入的文档数和每秒写入文档数上限，未设置时不限速
+REPAIR_BATCH_SIZE = int(os.getenv("REPAIR_BATCH_SIZE", "500"))
+REPAIR_RATE_LIMIT = float(os.getenv("REPAIR_RATE_LIMIT", "0")) or None
+search_engine = SearchEngine(
+    mongodb_url=MONGODB_URL,
+    mysql_connector=MySQLConnector,
+    parallel_workers=PARALLEL_WORKERS,
+    dimension_cache=DimensionCache(MySQLConnector),
+    mongo_batch_size=MONGO_BATCH_SIZE,
+    repair_batch_size=REPAIR_BATCH_SIZE,
+    repair_rate_limit=REPAIR_RATE_LIMIT,
+)
+
+
+async def ensure_indexes():
+    # 索引创建/检查失败（如权限不足）不影响服务启动，扫描退回到已有索引
+    try:
+        await asyncio.to_thread(search_engine.ensure_indexes)
+    except Exception as e:
+        logger.warning(f"Failed to ensure indexes: {e}")
+
+
+router.add_event_handler("startup", ensure_indexes)
+
+# 持续监听 MongoDB change stream 并比较的表，如 "product,series"（需要副本集）
+CHANGE_STREAM_TABLES = [
+    name.strip() for name in os.getenv("CHANGE_STREAM_TABLES", "").split(",") if name.strip()
+]
+CHANGE_STREAM_BATCH_SIZE = int(os.getenv("CHANGE_STREAM_BATCH_SIZE", "500"))
+CHANGE_STREAM_MAX_WAIT = float(os.getenv("CHANGE_STREAM_MAX_WAIT", "2"))
+change_stream_validators = {
+    table_name: ChangeStreamValidator(
+        search_engine,
+        table_name,
+        batch_size=CHANGE_STREAM_BATCH_SIZE,
+        max_wait=CHANGE_STREAM_MAX_WAIT,
+    )
+    for table_name in CHANGE_STREAM_TABLES
+}
+
+
+async def start_change_stream_validators():
+    for validator in change_stream_validators.values():
+        validator.start()
+
+
+async def stop_change_stream_validators():
+    for validator in change_stream_validators.values():
+        await asyncio.to_thread(validator.stop, CHANGE_STREAM_MAX_WAIT + 5)
+
+
+router.add_event_handler("startup", start_change_stream_validators)
+router.add_event_handler("shutdown", stop_change_stream_validators)
+
+# 脏ID跟踪的数据源："mysql" 读取 binlog，或一个 JSONL 回放文件的路径；未设置时不跟踪
+BINLOG_SOURCE = os.getenv("BINLOG_SOURCE")
+BINLOG_SERVER_ID = int(os.getenv("BINLOG_SERVER_ID", "4379"))
+dirty_tracker = None
+if BINLOG_SOURCE == "mysql":
+    dirty_tracker = DirtyIdTracker(
+        search_engine, BinlogSource(MySQLConnector, BINLOG_SERVER_ID)
+    )
+elif BINLOG_SOURCE:
+    dirty_tracker = DirtyIdTracker(search_engine, ReplaySource(BINLOG_SOURCE))
+
+
+async def start_dirty_tracker():
+    if dirty_tracker is not None:
+        dirty_tracker.start()
+
+
+async def stop_dirty_tracker():
+    if dirty_tracker is not None:
+        await asyncio.to_thread(dirty_tracker.stop, 5)
+
+
+router.add_event_handler("startup", start_dirty_tracker)
+router.add_event_handler("shutdown", stop_dirty_tracker)
+
+# 后台任务同时运行的数量上限
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "1"))
+job_manager = JobManager(max_workers=MAX_CONCURRENT_JOBS)
+
+metrics.REGISTRY.add_collector(
+    "validation_mysql_pool_connections",
+    "MySQL connection pool size and connections by state.",
+    lambda: {(state,): value for state, value in MySQLConnector.pool_stats().items()},
+    ("state",),
+)
+metrics.REGISTRY.add_collector(
+    "validation_series_cache",
+    "search_series comparison cache statistics.",
+    lambda: {(key,): value for key, value in search_engine.series_cache.stats().items()},
+    ("stat",),
+)
+
+SEARCH_TASKS = {
+    "seriesId": ("series", "series_ids"),
+    "productId": ("product", "product_ids"),
+    "productDocuments": ("product", "product_documents"),
+    "repair": (None, "repair"),
+    "dirtyIds": (None, "dirty_ids"),
+}
 
 
 class Item(BaseModel):
@@ -34,6 +154,15 @@ class Item(BaseModel):
 class productItem(BaseModel):
     product_ids: List[int]  # 接受请求体中的整数数组
 
+class DocumentTable(str, Enum):
+    series = "series"
+    product = "product"
+
+class RepairItem(BaseModel):
+    table: DocumentTable
+    ids: List[int] = []  # 需要修复的ID
+    run_id: Optional[str] = None  # 或者修复某次比较报告中的全部ID
+
 @router.post("/series")
 async def series(series_ids: Item) -> Any:
 
@@ -62,23 +191,46 @@ async def series(series_ids: Item) -> Any:
 
     return results
 
-async def execute_search_task(task_name: str) -> Dict[str, Any]:
-    current_timestamp = utils.get_unix_timestamp()
-    results = {
-        "status": {"code": 0, "message": f"It is working for {task_name}!"},
-        "server": {"time": current_timestamp},
+def build_results(message: str) -> Dict[str, Any]:
+    return {
+        "status": {"code": 0, "message": message},
+        "server": {"time": utils.get_unix_timestamp()},
         "data": {},
     }
 
-    async def search_task():
-        if task_name == "seriesId":
-            results["data"]["series_ids"] = await search_engine.search_data("series")
-        elif task_name == "productId":
-            results["data"]["product_ids"] = await search_engine.search_data("product")
 
-    await asyncio.gather(search_task())
+@router.get("/series/cache")
+async def series_cache() -> Any:
+    results = build_results("It is working!")
+    results["data"]["cache"] = search_engine.series_cache.stats()
+    return results
 
-    if results["data"].get("series_ids") or results["data"].get("product_ids"):
+async def execute_search_task(
+    task_name: str,
+    background: bool = False,
+    mode: ReconcileMode = ReconcileMode.full,
+    snapshot_time: Optional[int] = None,
+) -> Dict[str, Any]:
+    table_name, data_key = SEARCH_TASKS[task_name]
+
+    def reconcile(progress):
+        return search_engine.reconcile_table(table_name, progress, mode, snapshot_time)
+
+    # 同一张表、同一模式和快照时间的请求共用一个任务
+    key = (task_name, ReconcileMode(mode).value, snapshot_time)
+
+    if background:
+        # 提交后台任务，立即返回任务ID
+        job = job_manager.submit(task_name, reconcile, key=key)
+        results = build_results(f"Job queued for {task_name}!")
+        results["data"]["job"] = job.to_dict()
+        return results
+
+    # 同步请求也经过任务队列，与后台任务共用并发上限，等待结果后返回
+    results = build_results(f"It is working for {task_name}!")
+    results["data"][data_key] = await job_manager.run(task_name, reconcile, key=key)
+
+    if results["data"].get(data_key):
         results["data"]["code"] = 1
     else:
         results["data"]["code"] = 0
@@ -86,9 +238,157 @@ async def execute_search_task(task_name: str) -> Dict[str, Any]:
     return results
 
 @router.post("/seriesId")
-async def seriesId() -> Any:
-    return await execute_search_task("seriesId")
+async def seriesId(
+    background: bool = False,
+    mode: ReconcileMode = ReconcileMode.full,
+    snapshot_time: Optional[int] = None,
+) -> Any:
+    return await execute_search_task("seriesId", background, mode, snapshot_time)
 
 @router.post("/product")
-async def product() -> Any:
-    return await execute_search_task("productId")
\ No newline at end of file
+async def product(
+    background: bool = False,
+    mode: ReconcileMode = ReconcileMode.full,
+    snapshot_time: Optional[int] = None,
+) -> Any:
+    return await execute_search_task("productId", background, mode, snapshot_time)
+
+@router.post("/productDocuments")
+async def product_documents(product_ids: productItem, background: bool = False) -> Any:
+    if background:
+        ids = product_ids.product_ids
+        job = job_manager.submit(
+            "productDocuments",
+            lambda progress: search_engine.validate_product_documents(ids, progress),
+            dedupe=False,
+        )
+        results = build_results("Job queued for productDocuments!")
+        results["data"]["job"] = job.to_dict()
+        return results
+
+    # 逐批返回差异，每行一个 JSON 对象；比较在任务队列中执行，与其他任务共用并发上限
+    def stream():
+        ids = product_ids.product_ids
+        for chunk, mysql_count, mongo_count, differences in job_manager.stream(
+            "productDocuments",
+            lambda progress: search_engine.iter_product_differences(ids),
+        ):
+            line = {
+                "ids": len(chunk),
+                "mysql_count": mysql_count,
+                "mongo_count": mongo_count,
+                "differences": differences,
+            }
+            yield json.dumps(jsonable_encoder(line)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.post("/repair")
+async def repair(item: RepairItem, dry_run: bool = True, background: bool = False) -> Any:
+    table_name = item.table.value
+    ids = list(item.ids)
+    if item.run_id is not None:
+        try:
+            ids += read_report_ids(search_engine.report_dir, table_name, item.run_id)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+    if not ids:
+        raise HTTPException(status_code=400, detail="No ids to repair")
+
+    if background:
+        job = job_manager.submit(
+            "repair",
+            lambda progress: search_engine.repair_documents(
+                table_name, ids, dry_run=dry_run, progress=progress
+            ),
+            dedupe=False,
+        )
+        results = build_results("Job queued for repair!")
+        results["data"]["job"] = job.to_dict()
+        return results
+
+    results = build_results("It is working for repair!")
+    results["data"]["repair"] = await job_manager.run(
+        "repair",
+        lambda progress: search_engine.repair_documents(
+            table_name, ids, dry_run=dry_run, progress=progress
+        ),
+        dedupe=False,
+    )
+    return results
+
+@router.get("/changeStream")
+async def change_stream() -> Any:
+    results = build_results("It is working!")
+    results["data"]["validators"] = [
+        validator.to_dict() for validator in change_stream_validators.values()
+    ]
+    return results
+
+def get_dirty_tracker_or_409():
+    if dirty_tracker is None:
+        raise HTTPException(status_code=409, detail="Dirty-ID tracking is not enabled")
+    return dirty_tracker
+
+@router.get("/dirtyIds")
+async def dirty_ids() -> Any:
+    results = build_results("It is working!")
+    results["data"]["tracker"] = get_dirty_tracker_or_409().to_dict()
+    return results
+
+@router.post("/dirtyIds/validate")
+async def validate_dirty_ids(
+    table: DocumentTable, batch_size: int = 1000, background: bool = False
+) -> Any:
+    tracker = get_dirty_tracker_or_409()
+    table_name = table.value
+
+    if background:
+        job = job_manager.submit(
+            "dirtyIds",
+            lambda progress: tracker.validate(table_name, batch_size, progress),
+            dedupe=False,
+        )
+        results = build_results("Job queued for dirtyIds!")
+        results["data"]["job"] = job.to_dict()
+        return results
+
+    results = build_results("It is working for dirtyIds!")
+    results["data"]["dirty_ids"] = await job_manager.run(
+        "dirtyIds",
+        lambda progress: tracker.validate(table_name, batch_size, progress),
+        dedupe=False,
+    )
+    return results
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@router.get("/jobs/{job_id}")
+async def job_status(job_id: str) -> Any:
+    job = get_job_or_404(job_id)
+    results = build_results(f"Job {job.status}")
+    results["data"]["job"] = job.to_dict()
+    return results
+
+@router.get("/jobs/{job_id}/result")
+async def job_result(job_id: str) -> Any:
+    job = get_job_or_404(job_id)
+    if not job.done:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status}")
+
+    results = build_results(f"Job {job.status}")
+    results["data"]["job"] = job.to_dict()
+    if job.status == "failed":
+        results["status"]["code"] = 1
+        return results
+
+    _, data_key = SEARCH_TASKS[job.name]
+    results["data"][data_key] = job.result
+    results["data"]["code"] = 1 if job.result else 0
+    return results
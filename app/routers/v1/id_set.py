@@ -0,0 +1,124 @@
+import numbers
+
+import numpy as np
+
+
+def normalize_id(value):
+    """
+    Convert a MySQL or MongoDB ID into the integer form used for comparison.
+
+    MySQL primary keys are always integers. MongoDB `_id`s are expected to be
+    stored as numbers too, but documents written by other tools may hold them
+    as `Int64`, integral `double`, or a string / ObjectId. The rule is:
+
+    - int (including `bson.int64.Int64`) and integral floats are returned as int.
+    - Anything else (strings, ObjectId, bool, non-integral floats) returns None.
+
+    A document whose `_id` is not numeric cannot be found by the integer ID the
+    applications query with, so callers treat it as drift: it is reported as an
+    ID that exists only in MongoDB (with its raw value), and the matching MySQL
+    ID, if any, is reported as missing from MongoDB.
+
+    Args:
+        value: The raw ID value.
+
+    Returns:
+        int | None: The normalized ID, or None if it cannot be compared as an integer.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return None
+
+
+def id_sort_key(value):
+    """
+    Sort key for a list of raw IDs: numeric IDs in numeric order, followed by
+    the non-numeric ones ordered by their string form.
+    """
+    normalized = normalize_id(value)
+    if normalized is None:
+        return (1, 0, str(value))
+    return (0, normalized, "")
+
+
+class IdSet:
+    """
+    An immutable set of integer IDs stored as a sorted, de-duplicated int64 array.
+
+    Compared with a Python `set` of `str`, this uses 8 bytes per ID and the set
+    operations run as vectorized merges over the sorted arrays.
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, ids=None) -> None:
+        if ids is None:
+            self._ids = np.empty(0, dtype=np.int64)
+        else:
+            self._ids = np.unique(np.asarray(ids, dtype=np.int64))
+
+    @classmethod
+    def _from_sorted(cls, array):
+        id_set = cls.__new__(cls)
+        id_set._ids = array
+        return id_set
+
+    @classmethod
+    def from_iterable(cls, ids, chunk_size=100000):
+        """
+        Build an IdSet from an iterable of ints without holding a Python list of all of them.
+        """
+        chunks = []
+        buffer = np.empty(chunk_size, dtype=np.int64)
+        size = 0
+        for id in ids:
+            buffer[size] = id
+            size += 1
+            if size == chunk_size:
+                chunks.append(buffer.copy())
+                size = 0
+        chunks.append(buffer[:size].copy())
+        return cls(np.concatenate(chunks))
+
+    @property
+    def array(self):
+        return self._ids
+
+    def difference(self, other):
+        return IdSet._from_sorted(
+            np.setdiff1d(self._ids, other._ids, assume_unique=True)
+        )
+
+    def intersection(self, other):
+        return IdSet._from_sorted(
+            np.intersect1d(self._ids, other._ids, assume_unique=True)
+        )
+
+    def union(self, other):
+        return IdSet._from_sorted(np.union1d(self._ids, other._ids))
+
+    __sub__ = difference
+    __and__ = intersection
+    __or__ = union
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids.tolist())
+
+    def __contains__(self, id):
+        index = np.searchsorted(self._ids, id)
+        return bool(index < len(self._ids) and self._ids[index] == id)
+
+    def __eq__(self, other):
+        if not isinstance(other, IdSet):
+            return NotImplemented
+        return np.array_equal(self._ids, other._ids)
+
+    def __repr__(self):
+        return f"{set(self)}"
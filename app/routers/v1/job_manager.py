@@ -0,0 +1,215 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+
+class ReconcileProgress:
+    """
+    Counters updated by a running reconciliation and read by the status API.
+    """
+
+    def __init__(self) -> None:
+        self.mysql_scanned = 0
+        self.mongo_scanned = 0
+        self.missing_in_mongo = 0
+        self.missing_in_mysql = 0
+        self.last_modified_mismatches = 0
+        self.document_mismatches = 0
+        self.repaired = 0
+        self.last_id = None
+        self.min_id = None
+        self.max_id = None
+        self.started_at = time.time()
+
+    def eta_seconds(self):
+        # 按已扫描到的ID在ID范围中的位置估算剩余时间
+        if self.last_id is None or self.min_id is None or self.max_id is None:
+            return None
+        if self.max_id <= self.min_id:
+            return 0
+        fraction = (self.last_id - self.min_id + 1) / (self.max_id - self.min_id + 1)
+        fraction = min(max(fraction, 1e-6), 1.0)
+        elapsed = time.time() - self.started_at
+        return int(elapsed / fraction - elapsed)
+
+    def to_dict(self):
+        return {
+            "mysql_scanned": self.mysql_scanned,
+            "mongo_scanned": self.mongo_scanned,
+            "missing_in_mongo": self.missing_in_mongo,
+            "missing_in_mysql": self.missing_in_mysql,
+            "last_modified_mismatches": self.last_modified_mismatches,
+            "document_mismatches": self.document_mismatches,
+            "repaired": self.repaired,
+            "last_id": self.last_id,
+            "min_id": self.min_id,
+            "max_id": self.max_id,
+            "eta_seconds": self.eta_seconds(),
+        }
+
+
+class Job:
+    def __init__(self, job_id, name, key=None) -> None:
+        self.job_id = job_id
+        self.name = name
+        self.key = name if key is None else key
+        self.status = "queued"
+        self.progress = ReconcileProgress()
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.exception = None
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "name": self.name,
+            "status": self.status,
+            "progress": self.progress.to_dict(),
+            "error": self.error,
+            "created_at": int(self.created_at),
+            "started_at": int(self.started_at) if self.started_at else None,
+            "finished_at": int(self.finished_at) if self.finished_at else None,
+        }
+
+
+class JobManager:
+    """
+    In-process runner for long reconciliations.
+
+    At most `max_workers` jobs run at once; further jobs wait in the queue.
+    Submitting a job with the same key (by default its name) as a queued or
+    running job returns the existing job instead of starting another
+    full-table scan. Synchronous requests go through the same queue via `run`,
+    streamed ones via `stream`.
+    """
+
+    def __init__(self, max_workers=1, max_history=100) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="reconcile-job"
+        )
+        self.max_history = max_history
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, dedupe=True, key=None):
+        """
+        Enqueue `fn(progress)` as a job.
+
+        Args:
+            key (Hashable): Identifies jobs doing the same work, e.g. the name
+                plus the parameters that change the result. Defaults to `name`.
+            dedupe (bool): With False a new job is always created, for jobs
+                whose input differs between requests.
+
+        Returns:
+            Job: The new job, or the active job with the same key.
+        """
+        with self._lock:
+            job = Job(uuid.uuid4().hex, name, key)
+            for active in self.jobs.values():
+                if dedupe and active.key == job.key and not active.done:
+                    return active
+
+            self.jobs[job.job_id] = job
+            self._evict()
+            job.future = self.executor.submit(self._run, job, fn)
+        return job
+
+    async def run(self, name, fn, dedupe=True, key=None):
+        """
+        Submit `fn(progress)` like `submit` and wait for its result, so that
+        synchronous requests share the concurrency limit of background jobs.
+
+        Raises:
+            Exception: The exception raised by `fn`.
+        """
+        job = self.submit(name, fn, dedupe, key)
+        await asyncio.wrap_future(job.future)
+        if job.exception is not None:
+            raise job.exception
+        return job.result
+
+    def stream(self, name, fn, max_pending=2):
+        """
+        Run the generator `fn(progress)` as a job and yield its items in the
+        calling thread as they are produced. The job keeps its worker until
+        the generator is exhausted or the caller stops iterating; at most
+        `max_pending` items are buffered in between.
+
+        Raises:
+            Exception: The exception raised by `fn`.
+        """
+        items = queue.Queue(maxsize=max_pending)
+        closed = threading.Event()
+
+        def put(item):
+            # 调用方不再读取时放弃，避免工作线程一直阻塞
+            while not closed.is_set():
+                try:
+                    items.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce(progress):
+            error = None
+            try:
+                for item in fn(progress):
+                    if not put((False, item)):
+                        return
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                put((True, error))
+
+        self.submit(name, produce, dedupe=False)
+        try:
+            while True:
+                finished, item = items.get()
+                if finished:
+                    if item is not None:
+                        raise item
+                    return
+                yield item
+        finally:
+            closed.set()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _run(self, job, fn):
+        job.status = "running"
+        job.started_at = time.time()
+        job.progress.started_at = job.started_at
+        try:
+            job.result = fn(job.progress)
+            job.status = "succeeded"
+        except Exception as e:
+            logger.exception(f"Job {job.job_id} ({job.name}) failed")
+            job.exception = e
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _evict(self):
+        # 只保留最近的已完成任务
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[: max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job_id]
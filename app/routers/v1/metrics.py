@@ -0,0 +1,241 @@
+"""
+In-process metrics exposed in the Prometheus text format on `/api/metrics`.
+
+Only counters and histograms are recorded on the hot path; values that
+already live elsewhere (pool size, cache stats, ...) are read on scrape
+through registered collectors. Metrics recorded in the worker processes of
+the parallel reconcile mode are not included.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][index] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {entry['count']}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {entry['sum']}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, name, documentation, collect, labelnames=()):
+        """
+        Register a gauge whose values are read on scrape.
+
+        Args:
+            collect (callable): Returns {label values tuple: value}.
+        """
+        with self._lock:
+            self._collectors.append((name, documentation, collect, tuple(labelnames)))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for name, documentation, collect, labelnames in collectors:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            for key, value in sorted(collect().items()):
+                if value is None:
+                    continue
+                lines.append(f"{name}{_format_labels(labelnames, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(
+    Histogram(
+        "validation_stage_seconds",
+        "Latency of a reconciliation stage (per call or per batch).",
+        ("stage", "table"),
+    )
+)
+DB_QUERY_SECONDS = REGISTRY.register(
+    Histogram(
+        "validation_db_query_seconds",
+        "Latency of a single database round trip.",
+        ("store",),
+    )
+)
+DB_QUERIES = REGISTRY.register(
+    Counter(
+        "validation_db_queries_total",
+        "Database round trips (MySQL queries, MongoDB commands).",
+        ("store",),
+    )
+)
+DB_ROWS = REGISTRY.register(
+    Counter(
+        "validation_db_rows_total",
+        "Rows / documents transferred from the database.",
+        ("store",),
+    )
+)
+POOL_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "validation_mysql_pool_wait_seconds",
+        "Time spent waiting for a MySQL connection from the pool.",
+        buckets=(0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5, 10, 30),
+    )
+)
+
+
+class InstrumentedCursor:
+    """
+    Wraps a MySQL cursor and records query counts, latency and fetched rows.
+    """
+
+    def __init__(self, cursor) -> None:
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        DB_QUERIES.inc(store="mysql")
+        with DB_QUERY_SECONDS.time(store="mysql"):
+            return self._cursor.execute(*args, **kwargs)
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        DB_ROWS.inc(len(rows), store="mysql")
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self._cursor.fetchmany(*args, **kwargs)
+        DB_ROWS.inc(len(rows), store="mysql")
+        return rows
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            DB_ROWS.inc(store="mysql")
+        return row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        for row in self._cursor:
+            DB_ROWS.inc(store="mysql")
+            yield row
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Records MongoDB command counts, latency and returned documents.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        DB_QUERIES.inc(store="mongo")
+        DB_QUERY_SECONDS.observe(event.duration_micros / 1e6, store="mongo")
+        cursor = event.reply.get("cursor") if hasattr(event.reply, "get") else None
+        if cursor:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", ()))
+            DB_ROWS.inc(len(batch), store="mongo")
+
+    def failed(self, event):
+        DB_QUERIES.inc(store="mongo")
+        DB_QUERY_SECONDS.observe(event.duration_micros / 1e6, store="mongo")
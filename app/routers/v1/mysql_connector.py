@@ -1,6 +1,16 @@
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
 import mysql.connector
+from loguru import logger
 from tqdm import tqdm
 
+from .metrics import POOL_WAIT_SECONDS, InstrumentedCursor
+
 
 class MySQLConnector:
     def __init__(
@@ -9,17 +19,33 @@ class MySQLConnector:
         host,
         user,
         password,
+        port=3306,
+        pool_size=5,
+        pool_timeout=30,
+        health_check_interval=30,
+        max_prepared_statements=32,
     ) -> None:
 
         self.database = database
         self.host = host
         self.user = user
         self.password = password
-        self.port = 3306
-        self.connection = None
+        self.port = port
+
+        # 连接池配置
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+        # 每个连接上保留的预处理游标 {id(connection): {sql: cursor}}，按最近使用排序
+        self.max_prepared_statements = max_prepared_statements
+        self._statements = {}
 
     def connect(self):
-        self.connection = mysql.connector.connect(
+        return mysql.connector.connect(
             host=self.host,
             database=self.database,
             user=self.user,
@@ -27,41 +53,182 @@ class MySQLConnector:
             port=self.port,
         )
 
-    def get_cursor(self):
-        if self.connection.is_connected():
-            return self.connection.cursor()
+    def _checkout(self):
+        # 优先复用空闲连接，池未满时新建，否则等待其他请求归还
+        deadline = time.monotonic() + self.pool_timeout
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.pool_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self.connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"No MySQL connection available within {self.pool_timeout}s (pool_size={self.pool_size})."
+                    )
+                try:
+                    # 分段等待，期间若有连接被丢弃可以及时新建
+                    connection, last_used = self._idle.get(timeout=min(remaining, 1))
+                except queue.Empty:
+                    continue
+
+            if time.monotonic() - last_used < self.health_check_interval:
+                return connection
+
+            # 空闲较久的连接先做健康检查，失效则重连。重连后服务端的预处理语句已失效，
+            # 而缓存的游标仍带着旧的 statement_id，所以先丢弃该连接上的预处理游标
+            self._drop_statements(connection)
+            try:
+                connection.ping(reconnect=True, attempts=1)
+                return connection
+            except Exception as e:
+                logger.warning(f"Discarding stale MySQL connection: {e}")
+                self._discard(connection)
+
+    def _checkin(self, connection):
+        try:
+            if connection.is_connected():
+                connection.rollback()
+                self._idle.put((connection, time.monotonic()))
+                return
+        except Exception:
+            pass
+        self._discard(connection)
+
+    def _drop_statements(self, connection):
+        with self._lock:
+            statements = self._statements.pop(id(connection), None)
+        for cursor in (statements or {}).values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def _discard(self, connection):
+        with self._lock:
+            self._created -= 1
+            self._statements.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        从连接池借出一个连接，使用完毕后自动归还。
+        """
+        started = time.perf_counter()
+        connection = self._checkout()
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            yield connection
+        except BaseException:
+            self._discard(connection)
+            raise
         else:
-            raise Exception("Connection is not established.")
+            self._checkin(connection)
+
+    @contextmanager
+    def cursor(self, prepared=False):
+        with self.connection() as connection:
+            cursor = connection.cursor(prepared=prepared)
+            try:
+                yield InstrumentedCursor(cursor)
+            finally:
+                cursor.close()
+
+    @contextmanager
+    def prepared_cursor(self, sql):
+        """
+        借出一个连接上为 sql 预处理过的游标，同一连接上相同的SQL只预处理一次。
+
+        驱动按字符串对象是否相同判断是否需要重新预处理，所以 sql 先做 intern，
+        调用方执行时必须使用 yield 出的 sql。
+        """
+        sql = sys.intern(sql)
+        with self.connection() as connection:
+            with self._lock:
+                statements = self._statements.setdefault(id(connection), OrderedDict())
+            cursor = statements.pop(sql, None)
+            if cursor is None:
+                cursor = connection.cursor(prepared=True)
+            statements[sql] = cursor
+            while len(statements) > self.max_prepared_statements:
+                _, stale = statements.popitem(last=False)
+                stale.close()
+            yield InstrumentedCursor(cursor), sql
+
+    def pool_stats(self):
+        with self._lock:
+            created = self._created
+        idle = self._idle.qsize()
+        return {"size": self.pool_size, "idle": idle, "in_use": created - idle}
 
     def close(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
+        # 关闭所有空闲连接
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(connection)
 
-    def query(self, sql, batch_size=100):
-        all_rows = []
-        self.connect()
-        try:
-            with self.connection.cursor() as cursor:
-                cursor.execute(sql)
-                columns = [col[0] for col in cursor.description]
-
-                with tqdm(
-                    total=cursor.rowcount, desc="MySQL Querying", leave=True, position=0
-                ) as progress_bar:
-                    while True:
-                        rows = cursor.fetchmany(batch_size)
-                        if not rows:
-                            break
-
-                        for row in rows:
-                            dict_ = {}
-                            for col, value in zip(columns, row):
-                                dict_[col] = value
-                            all_rows.append(dict_)
-
-                        progress_bar.update(len(rows))
-        except Exception as e:
-            raise e
-        finally:
-            self.connection.close()
-        return all_rows
+    def iter_query(
+        self, sql, params=None, batch_size=1000, prepared=False, row_format="dict"
+    ):
+        """
+        在非缓冲（服务端）游标上执行查询，按批拉取并逐行返回，内存占用与结果集大小无关。
+
+        row_format: "dict" 返回字典；"tuple" 返回原始元组；
+        "record" 返回 namedtuple（按列名访问，不为每行创建字典）。
+        """
+        if row_format not in ("dict", "tuple", "record"):
+            raise ValueError(f"Invalid row format: {row_format}")
+
+        if prepared:
+            cursor_context = self.prepared_cursor(sql)
+        else:
+            cursor_context = self.cursor()
+
+        with cursor_context as cursor:
+            if prepared:
+                cursor, sql = cursor
+            cursor.execute(sql, params)
+            columns = [col[0] for col in cursor.description]
+
+            make_row = None
+            if row_format == "dict":
+                make_row = lambda row: dict(zip(columns, row))
+            elif row_format == "record":
+                make_row = namedtuple("Record", columns, rename=True)._make
+
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                if make_row is None:
+                    yield from rows
+                else:
+                    yield from map(make_row, rows)
+
+    def query(self, sql, params=None, batch_size=100, prepared=False):
+        return list(
+            tqdm(
+                self.iter_query(sql, params, batch_size, prepared),
+                desc="MySQL Querying",
+                leave=True,
+                position=0,
+            )
+        )
@@ -0,0 +1,98 @@
+"""
+Canonical forms for the list fields shared by the ETL, MongoDB documents and the diff engine.
+
+The list fields are stored in MySQL as comma-separated strings and in MongoDB
+as arrays, in no particular order. Both are converted once per row into a
+frozenset of stripped words, with its hash computed up front, so comparing
+two list fields is a single equality check.
+"""
+
+import datetime
+from decimal import Decimal
+
+from bson.decimal128 import Decimal128
+
+LIST_FIELDS = {
+    "series": ("keyword", "actor_names", "alternative_names", "tag_names"),
+    "product": ("keyword", "guest_tag_names"),
+}
+
+
+def normalize_list(values):
+    """
+    Convert an iterable of words into a frozenset with a precomputed hash.
+
+    Falls back to a tuple when the items are not hashable (e.g. sub-documents).
+    """
+    try:
+        normalized = frozenset(values)
+    except TypeError:
+        return tuple(values)
+    # frozenset caches its hash, and equality checks compare cached hashes first
+    hash(normalized)
+    return normalized
+
+
+def split_list_field(value):
+    """
+    Convert a comma-separated string into its canonical form.
+
+    Args:
+        value (str): e.g. "a, b,a".
+
+    Returns:
+        frozenset: e.g. frozenset({"a", "b"}).
+    """
+    return normalize_list(word.strip() for word in value.split(","))
+
+
+def normalize_document(table_name, doc):
+    """
+    Normalize the list fields of an ETL row or MongoDB document in place.
+
+    Empty / missing values are left untouched.
+    """
+    for field in LIST_FIELDS.get(table_name, ()):
+        value = doc.get(field)
+        if not value:
+            continue
+        if isinstance(value, str):
+            doc[field] = split_list_field(value)
+        elif isinstance(value, list):
+            doc[field] = normalize_list(value)
+    return doc
+
+
+def to_display(value):
+    """
+    Convert a normalized value back into a JSON-friendly form for reports.
+    """
+    if isinstance(value, frozenset):
+        return sorted(value, key=str)
+    return value
+
+
+def to_mongo_document(table_name, row):
+    """
+    Convert an ETL row into the document written to MongoDB when repairing drift.
+
+    List fields become arrays of words; values BSON cannot encode are converted
+    (`Decimal` to `Decimal128`, `date` to a midnight `datetime`).
+    """
+    list_fields = LIST_FIELDS.get(table_name, ())
+    doc = {}
+    for key, value in row.items():
+        if key in list_fields and isinstance(value, str) and value:
+            value = list(dict.fromkeys(word.strip() for word in value.split(",")))
+        elif isinstance(value, frozenset):
+            value = to_display(value)
+        elif isinstance(value, tuple):
+            value = list(value)
+        elif isinstance(value, Decimal):
+            value = Decimal128(value)
+        elif isinstance(value, datetime.date) and not isinstance(
+            value, datetime.datetime
+        ):
+            value = datetime.datetime.combine(value, datetime.time())
+        doc[key] = value
+    return doc
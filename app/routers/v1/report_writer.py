@@ -0,0 +1,107 @@
+import json
+import os
+import time
+import uuid
+from collections import Counter
+
+
+class MismatchReport:
+    """
+    Mismatches of one validation run, streamed through a single buffered writer.
+
+    Every run gets its own directory `{root}/{table_name}/{run_id}/` containing:
+
+    - `mismatches.jsonl`: one JSON object per mismatch, e.g.
+      {"type": "missing_in_mongo", "id": 42} or
+      {"type": "document_mismatch", "id": 42, "differences": {...}}
+    - `manifest.json`: run metadata, the number of records per type and a
+      free-form summary, written atomically when the report is closed.
+
+    Use it as a context manager; the run is marked "failed" in the manifest
+    when the block raises.
+    """
+
+    FILENAME = "mismatches.jsonl"
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root, table_name, kind, buffer_size=1 << 20) -> None:
+        self.table_name = table_name
+        self.kind = kind
+        self.started_at = time.time()
+        self.run_id = (
+            time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(self.started_at))
+            + f"-{uuid.uuid4().hex[:8]}"
+        )
+        self.directory = os.path.join(root, table_name, self.run_id)
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, self.FILENAME)
+        self.counts = Counter()
+        self.summary = {}
+        self._file = open(self.path, "w", buffering=buffer_size)
+
+    def write(self, type, id, **fields):
+        self._file.write(json.dumps({"type": type, "id": id, **fields}, default=str))
+        self._file.write("\n")
+        self.counts[type] += 1
+
+    def write_ids(self, type, ids):
+        count = 0
+        for id in ids:
+            self._file.write(f'{{"type": "{type}", "id": {json.dumps(id, default=str)}}}\n')
+            count += 1
+        self.counts[type] += count
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self, status="succeeded"):
+        if self._file.closed:
+            return
+        self._file.close()
+        manifest = {
+            "run_id": self.run_id,
+            "table": self.table_name,
+            "kind": self.kind,
+            "status": status,
+            "started_at": int(self.started_at),
+            "finished_at": int(time.time()),
+            "file": self.FILENAME,
+            "counts": dict(self.counts),
+            "summary": self.summary,
+        }
+        path = os.path.join(self.directory, self.MANIFEST)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(manifest, file, indent=2, default=str)
+        os.replace(f"{path}.tmp", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close("failed" if exc_type else "succeeded")
+
+
+def read_report_ids(root, table_name, run_id, types=None):
+    """
+    Read the mismatched IDs of a finished run, e.g. to repair them.
+
+    Args:
+        types (Iterable[str]): The record types to include, all when None.
+
+    Returns:
+        list: The IDs in report order, without duplicates.
+    """
+    if os.path.basename(run_id) != run_id or run_id in ("", ".", ".."):
+        raise ValueError(f"Invalid run id: {run_id}")
+    path = os.path.join(root, table_name, run_id, MismatchReport.FILENAME)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {table_name} report for run {run_id}")
+
+    types = set(types) if types is not None else None
+    ids = {}
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if types is None or record["type"] in types:
+                ids[record["id"]] = None
+    return list(ids)
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+
+class ComparisonCache:
+    """
+    Bounded LRU cache of per-ID comparison results.
+
+    Each entry is stored with the version it was computed for, i.e. the
+    `last_modified_time` seen on MySQL and on MongoDB. A lookup only hits when
+    both versions are unchanged, so any write on either side makes the entry
+    stale.
+    """
+
+    def __init__(self, max_size=100000) -> None:
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id, version):
+        """
+        Returns:
+            tuple: (hit, result). `result` is only meaningful when `hit` is True.
+        """
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(id)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, id, version, result):
+        with self._lock:
+            self._entries[id] = (version, result)
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
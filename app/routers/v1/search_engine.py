@@ -1,19 +1,106 @@
+import asyncio
+import multiprocessing
 import os
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import dotenv
-from pymongo import MongoClient
+from pymongo import DeleteOne, MongoClient, ReplaceOne
+from mysql.connector import errors as mysql_errors
+from pymongo.errors import AutoReconnect, BulkWriteError, CursorNotFound
 from .mysql_connector import MySQLConnector
 from loguru import logger
-from .sqls import series_sql, product_sql, product_id_sql
+from .sqls import (
+    series_sql,
+    product_sql,
+    product_id_sql,
+    range_digest_sql,
+    series_base_sql,
+    series_ccs_relation_sql,
+    series_actor_relation_sql,
+    series_tag_relation_sql,
+    product_base_sql,
+    product_tag_relation_sql,
+    series_ids_by_ccs_group_sql,
+)
+from .utils import RateLimiter, backoff_delay, chunked, chunked_groups, prefetch, retry
+from .id_set import IdSet, id_sort_key, normalize_id
+from .diff_engine import diff_documents
+from .normalization import normalize_document, to_mongo_document
+from .job_manager import ReconcileProgress
+from .metrics import STAGE_SECONDS, MongoCommandListener
+from .state_store import StateStore
+from .report_writer import MismatchReport
+from .result_cache import ComparisonCache
 from typing import List
+from enum import Enum
 
 dotenv.load_dotenv()
 
+
+class ReconcileMode(str, Enum):
+    # 全量归并扫描
+    full = "full"
+    # 只检查水位线之后修改过的ID
+    incremental = "incremental"
+    # 按ID区间比较摘要，只细查不一致的区间
+    checksum = "checksum"
+    # 按ID区间拆分，多进程并行归并扫描
+    parallel = "parallel"
+
+
+# 连接中断、主从切换等可以重试的驱动错误
+TRANSIENT_ERRORS = (
+    mysql_errors.OperationalError,
+    mysql_errors.InterfaceError,
+    AutoReconnect,
+)
+
+# MongoDB 存活文档扫描用的复合索引：等值条件在前，排序字段 _id 其次，范围条件在后，
+# 再带上 last_modified_time，使 ID/修改时间的扫描只读索引
+MONGO_SCAN_INDEX = [
+    ("is_deleted", 1),
+    ("_id", 1),
+    ("schedule_end_time", 1),
+    ("last_modified_time", 1),
+]
+# 增量模式按 last_modified_time 范围查询变更的ID：范围字段在前，带上 _id 使查询只读索引
+MONGO_CHANGED_INDEX = [
+    ("last_modified_time", 1),
+    ("_id", 1),
+]
+# 增量模式要求 MySQL 的 product/series 上有以 last_modified_time 开头的索引，
+# 否则每次增量比较都是全表扫描；服务只检查，不自动建索引
+MYSQL_CHANGED_INDEX_COLUMN = "last_modified_time"
+
+
 class SearchEngine:
-    def __init__(self, mysql_connector: MySQLConnector, mongodb_url=None) -> None:
+    def __init__(
+        self,
+        mysql_connector: MySQLConnector,
+        mongodb_url=None,
+        compare_chunk_size=5000,
+        state_store=None,
+        full_scan_interval=24 * 3600,
+        watermark_overlap=60,
+        parallel_workers=None,
+        document_chunk_size=1000,
+        etl_chunk_size=500,
+        dimension_cache=None,
+        series_cache_size=100000,
+        mongo_batch_size=20000,
+        report_dir=None,
+        checkpoint_interval=10,
+        max_retries=5,
+        retry_base_delay=0.5,
+        repair_batch_size=500,
+        repair_rate_limit=None,
+    ) -> None:
         # mongodb配置
         if mongodb_url is None:
             mongodb_url = os.getenv("MONGODB_URL")
-        self.client = MongoClient(mongodb_url)
+        self.mongodb_url = mongodb_url
+        self.client = MongoClient(mongodb_url, event_listeners=[MongoCommandListener()])
         self.db = self.client["search"]
         self.series_collection = self.db["series"]
         self.product_collection = self.db["product"]
@@ -22,17 +109,138 @@ class SearchEngine:
         # mysql配置
         self.mysql_connector = mysql_connector
 
-    async def search_series(self, series_ids: List[int]):
+        # 批量比较时每批的ID数量
+        self.compare_chunk_size = compare_chunk_size
+
+        # 增量比较：水位线持久化，超过 full_scan_interval 秒自动全量扫描一次，
+        # 读取水位线时回退 watermark_overlap 秒，容忍延迟提交的数据
+        if state_store is None:
+            state_store = StateStore(
+                os.getenv("VALIDATION_STATE_PATH", "validation_state.json")
+            )
+        self.state_store = state_store
+        self.full_scan_interval = full_scan_interval
+        self.watermark_overlap = watermark_overlap
+
+        # 并行模式的进程数，默认与CPU核数相同
+        self.parallel_workers = parallel_workers or os.cpu_count()
+
+        # 全字段比较时每批的ID数量
+        self.document_chunk_size = document_chunk_size
+
+        # ETL SQL 每批的ID数量
+        self.etl_chunk_size = etl_chunk_size
+
+        # 演员/标签名称的维度缓存，为 None 时使用单条ETL SQL
+        self.dimension_cache = dimension_cache
 
-        search_pipeline = {"_id": {"$in": series_ids.series_ids}}
+        # search_series 的单ID比较结果缓存
+        self.series_cache = ComparisonCache(max_size=series_cache_size)
 
-        mongo_results = self.series_collection.find(search_pipeline)
+        # MongoDB 扫描游标每批拉取的文档数
+        self.mongo_batch_size = mongo_batch_size
 
-        mysql_results = self.series_etl(series_ids)
-        mongo_list = list(mongo_results)
+        # 不一致报告的根目录，每次运行一个子目录
+        if report_dir is None:
+            report_dir = os.getenv("REPORT_DIR", "reports")
+        self.report_dir = report_dir
 
-        # 比较数组
-        differences = self.compare_objects_by_id(mysql_results, mongo_list)
+        # 全量扫描每处理 checkpoint_interval 批保存一次检查点
+        self.checkpoint_interval = checkpoint_interval
+
+        # 连接中断等临时错误的重试次数和退避基数（秒）
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+
+        # 修复模式每次 bulk_write 的文档数，以及每秒写入文档数上限（None 不限速）
+        self.repair_batch_size = repair_batch_size
+        self.repair_rate_limit = repair_rate_limit
+
+    def _get_collection(self, table_name):
+        collection = getattr(self, f"{table_name}_collection", None)
+        if collection is None:
+            raise ValueError(f"Invalid table name: {table_name}")
+        return collection
+
+    def _retry(self, fn):
+        return retry(
+            fn,
+            TRANSIENT_ERRORS,
+            attempts=self.max_retries + 1,
+            base_delay=self.retry_base_delay,
+        )
+
+    @staticmethod
+    def resolve_snapshot_time(snapshot_time=None):
+        """
+        一次比较中判断数据是否在线（schedule_end_time > 快照时间）所用的时间，未指定时取当前时间。
+        """
+        return int(time.time()) if snapshot_time is None else int(snapshot_time)
+
+    @staticmethod
+    def _mongo_live_query(schedule_end_time, lo=None, hi=None):
+        """
+        未删除且未过期文档的查询条件，lo/hi 限定 _id 区间 [lo, hi)。
+        字段顺序与 MONGO_SCAN_INDEX 一致。
+        """
+        query = {"is_deleted": 0}
+        id_range = {}
+        if lo is not None:
+            id_range["$gte"] = lo
+        if hi is not None:
+            id_range["$lt"] = hi
+        if id_range:
+            query["_id"] = id_range
+        query["schedule_end_time"] = {"$gt": schedule_end_time}
+        return query
+
+    def ensure_indexes(self):
+        """
+        在 product/series 上创建（或确认已存在）扫描用和增量查询用的索引，
+        并检查 MySQL 的同名表上是否有 last_modified_time 索引。
+        """
+        for table_name in ("product", "series"):
+            collection = self._get_collection(table_name)
+            existing = {
+                tuple(index["key"].items()) for index in collection.list_indexes()
+            }
+            for index in (MONGO_SCAN_INDEX, MONGO_CHANGED_INDEX):
+                if tuple(index) in existing:
+                    continue
+                name = collection.create_index(index)
+                logger.info(f"Created index {name} on MongoDB {table_name}")
+        self.check_mysql_indexes()
+
+    def check_mysql_indexes(self):
+        """
+        Returns:
+            list: 缺少 last_modified_time 索引的 MySQL 表名。
+        """
+        missing = []
+        for table_name in ("product", "series"):
+            with self.mysql_connector.cursor() as cursor:
+                cursor.execute(
+                    f"SHOW INDEX FROM {table_name} "
+                    "WHERE Column_name = %s AND Seq_in_index = 1",
+                    (MYSQL_CHANGED_INDEX_COLUMN,),
+                )
+                if cursor.fetchall():
+                    continue
+            missing.append(table_name)
+            logger.warning(
+                f"MySQL {table_name} has no index on {MYSQL_CHANGED_INDEX_COLUMN}; "
+                f"incremental reconciles will scan the whole table "
+                f"(CREATE INDEX idx_{MYSQL_CHANGED_INDEX_COLUMN} "
+                f"ON {table_name} ({MYSQL_CHANGED_INDEX_COLUMN}))"
+            )
+        return missing
+
+    async def search_series(self, series_ids: List[int]):
+
+        # 阻塞的数据库操作放到线程池中执行，避免阻塞事件循环
+        differences = await asyncio.to_thread(
+            self.compare_series, series_ids.series_ids
+        )
 
         # 打印结果
         if differences:
@@ -48,66 +256,953 @@ class SearchEngine:
 
         return None
 
-    async def search_data(self, table_name: str) -> bool:
-        self.mysql_connector.connect()
-        logger.info("get ids start !")
+    def compare_series(self, series_ids: List[int]):
+        """
+        全字段比较一组 series，结果按 (MySQL last_modified_time, MongoDB last_modified_time) 缓存，
+        只有两边版本有变化（或未缓存）的ID才重新执行ETL和比较。
+        """
+        ids = list(dict.fromkeys(series_ids))
+        if not ids:
+            return {}
+
+        # 按批查询两边的版本，两边都只统计与ETL相同条件（同一快照时间）的在线数据
+        snapshot_time = self.resolve_snapshot_time()
+        mysql_versions = {}
+        mongo_versions = {}
+        for chunk in chunked(ids, self.compare_chunk_size):
+            mysql_chunk, mongo_chunk = self._run_concurrently(
+                lambda: self.fetch_mysql_by_ids("series", chunk, snapshot_time),
+                lambda: self.fetch_mongo_by_ids("series", chunk, snapshot_time),
+            )
+            mysql_versions.update(mysql_chunk)
+            mongo_versions.update(mongo_chunk)
 
-        # 获取mysql id
-        mysql_ids = self.fetch_mysql_data(table_name)
-        mongo_ids = self.fetch_mongo_data(table_name)
+        differences = {}
+        stale_ids = []
+        for id in ids:
+            version = (mysql_versions.get(id), mongo_versions.get(id))
+            hit, result = self.series_cache.get(id, version)
+            if not hit:
+                stale_ids.append(id)
+            elif result:
+                differences[id] = result
+
+        if stale_ids:
+            # etl() 按整个 ccs 组聚合，每个ID的结果与同批的其他ID无关，才能按ID缓存
+            mysql_results, mongo_list = self._run_concurrently(
+                lambda: self.etl("series", stale_ids, snapshot_time),
+                lambda: self.fetch_mongo_documents("series", stale_ids, snapshot_time),
+            )
+            with STAGE_SECONDS.time(stage="diff", table="series"):
+                stale_differences = self.compare_objects_by_id(mysql_results, mongo_list)
+            for id in stale_ids:
+                version = (mysql_versions.get(id), mongo_versions.get(id))
+                self.series_cache.put(id, version, stale_differences.get(id))
+            differences.update(stale_differences)
+
+        logger.info(
+            f"series compared: {len(ids)}, recomputed: {len(stale_ids)}, cache: {self.series_cache.stats()}"
+        )
+        return differences
 
-        logger.info("get ids end !")
+    def _run_concurrently(self, *fns):
+        with ThreadPoolExecutor(max_workers=len(fns)) as executor:
+            futures = [executor.submit(fn) for fn in fns]
+            return [future.result() for future in futures]
+
+    async def search_data(
+        self, table_name: str, mode: ReconcileMode = None, snapshot_time=None
+    ) -> bool:
+        # 全表扫描是阻塞操作，放到线程池中执行，保持事件循环可响应其他请求
+        return await asyncio.to_thread(
+            self.reconcile_table, table_name, None, mode, snapshot_time
+        )
 
-        # 比较ID集合是否一致
-        logger.info("compare ids start !")
-        ids_match = self.compare_ids(table_name, mysql_ids, mongo_ids)
-        logger.info("compare ids end !")
+    def reconcile_table(
+        self,
+        table_name: str,
+        progress=None,
+        mode: ReconcileMode = None,
+        snapshot_time=None,
+    ) -> bool:
+        """
+        snapshot_time 为本次比较的快照时间，两边所有扫描都用它判断数据是否在线，未指定时取开始时间。
+        """
+        mode = ReconcileMode(mode or ReconcileMode.full)
+        if progress is None:
+            progress = ReconcileProgress()
+
+        watermark_key = f"{table_name}.watermark"
+        full_scan_key = f"{table_name}.last_full_scan"
+
+        if mode == ReconcileMode.incremental:
+            watermark = self.state_store.get(watermark_key)
+            last_full_scan = self.state_store.get(full_scan_key)
+            full_scan_due = (
+                last_full_scan is None
+                or time.time() - last_full_scan > self.full_scan_interval
+            )
+            if watermark is not None and not full_scan_due:
+                ids_match, watermark = self.reconcile_changes(
+                    table_name,
+                    watermark,
+                    progress,
+                    self.resolve_snapshot_time(snapshot_time),
+                )
+                self.state_store.set(watermark_key, watermark)
+                return ids_match
+            logger.info(f"{table_name} falls back to a full scan.")
+
+        # 全量扫描开始前的最大修改时间作为新的水位线，扫描期间的修改留给下次增量检查；
+        # 从检查点继续的扫描沿用第一次开始时的水位线和快照时间
+        checkpoint = None
+        if mode not in (ReconcileMode.checksum, ReconcileMode.parallel):
+            checkpoint = self.load_checkpoint(table_name, snapshot_time)
+        if checkpoint is not None:
+            snapshot_time = checkpoint.get("schedule_end_time", snapshot_time)
+        snapshot_time = self.resolve_snapshot_time(snapshot_time)
+        if checkpoint is not None and checkpoint["watermark"] is not None:
+            watermark = checkpoint["watermark"]
+        else:
+            watermark = self.fetch_mysql_max_last_modified_time(table_name)
+        if mode == ReconcileMode.checksum:
+            ids_match = self.reconcile_checksums(table_name, progress, snapshot_time)
+        elif mode == ReconcileMode.parallel:
+            ids_match = self.reconcile_parallel(
+                table_name, progress, schedule_end_time=snapshot_time
+            )
+        else:
+            ids_match = self.reconcile_full(
+                table_name, progress, watermark, snapshot_time
+            )
+        self.state_store.set(watermark_key, watermark)
+        self.state_store.set(full_scan_key, int(time.time()))
+        return ids_match
 
-        #compare field and value.
-        logger.info("compare fields start !")
-        self.compare_fields(table_name, mysql_ids)
-        logger.info("compare fields end !")
+    def reconcile_full(
+        self, table_name: str, progress, watermark=None, schedule_end_time=None
+    ) -> bool:
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        progress.min_id, progress.max_id = self.fetch_mysql_id_range(table_name)
+
+        # 定期保存检查点，进程中断后从最后保存的位置继续
+        checkpoint_key = f"{table_name}.full_scan_checkpoint"
+        checkpoint = self.load_checkpoint(table_name, schedule_end_time)
+        resume = None
+        if checkpoint is not None:
+            resume = (checkpoint["last_id"], checkpoint["result"])
+            logger.info(
+                f"{table_name} full scan resumes after id {checkpoint['last_id']}"
+            )
+
+        def save_checkpoint(last_id, result):
+            self.state_store.set(
+                checkpoint_key,
+                {
+                    "last_id": last_id,
+                    "watermark": watermark,
+                    "schedule_end_time": schedule_end_time,
+                    "updated_at": int(time.time()),
+                    # 保存当前结果的副本，之后的扫描还会继续追加
+                    "result": {
+                        key: list(value) if isinstance(value, list) else value
+                        for key, value in result.items()
+                    },
+                },
+            )
+
+        # 比较ID和字段，单次归并扫描
+        logger.info("reconcile ids start !")
+        result = self.reconcile_range(
+            table_name,
+            progress=progress,
+            resume=resume,
+            on_checkpoint=save_checkpoint,
+            schedule_end_time=schedule_end_time,
+        )
+        logger.info("reconcile ids end !")
 
-        self.mysql_connector.close()
+        result = self.recheck_mismatches(table_name, result, schedule_end_time, progress)
+        ids_match = self.write_reports(table_name, result, ReconcileMode.full.value)
+        self.state_store.delete(checkpoint_key)
+        return ids_match
 
+    def load_checkpoint(self, table_name, schedule_end_time=None):
+        """
+        Returns:
+            dict: 未完成的全量扫描检查点，不存在、超过 full_scan_interval 未更新，
+                  或与指定的快照时间不同时为 None。
+        """
+        checkpoint = self.state_store.get(f"{table_name}.full_scan_checkpoint")
+        if checkpoint is None:
+            return None
+        if (
+            schedule_end_time is not None
+            and checkpoint.get("schedule_end_time", schedule_end_time) != schedule_end_time
+        ):
+            return None
+        if time.time() - checkpoint["updated_at"] > self.full_scan_interval:
+            logger.info(f"{table_name} full scan checkpoint is stale, starting over.")
+            return None
+        return checkpoint
+
+    def reconcile_range(
+        self,
+        table_name,
+        lo=None,
+        hi=None,
+        progress=None,
+        resume=None,
+        on_checkpoint=None,
+        schedule_end_time=None,
+    ):
+        """
+        对ID区间 [lo, hi) 做归并扫描，并比较两边都存在的ID的 last_modified_time。
+
+        每处理 checkpoint_interval 批调用一次 on_checkpoint(last_id, result)，此时不大于 last_id 的ID都已处理完；
+        resume 为 (last_id, result) 时从 last_id 之后继续，并在该结果上累加。
+
+        Returns:
+            dict: 两边的行数和三类不一致的ID列表，可合并后交给 write_reports。
+        """
+        if progress is None:
+            progress = ReconcileProgress()
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+
+        result = {
+            "mysql_count": 0,
+            "mongo_count": 0,
+            "missing_in_mongo": [],
+            "missing_in_mysql": [],
+            "last_modified_mismatches": [],
+        }
+        if resume is not None:
+            last_id, result = resume
+            lo = last_id + 1
+            progress.last_id = last_id
+            progress.mysql_scanned = result["mysql_count"]
+            progress.mongo_scanned = result["mongo_count"]
+            progress.missing_in_mongo = len(result["missing_in_mongo"])
+            progress.missing_in_mysql = len(result["missing_in_mysql"])
+            progress.last_modified_mismatches = len(result["last_modified_mismatches"])
+
+        def matched_ids():
+            # 边扫描边比较ID，两边都存在的ID直接交给字段比较
+            for side, id in self.reconcile_ids(
+                table_name, schedule_end_time, lo=lo, hi=hi
+            ):
+                if side == "both":
+                    progress.mysql_scanned += 1
+                    progress.mongo_scanned += 1
+                    progress.last_id = id
+                    yield id
+                elif side == "mysql":
+                    progress.mysql_scanned += 1
+                    progress.missing_in_mongo += 1
+                    progress.last_id = id
+                    result["missing_in_mongo"].append(id)
+                    logger.warning(f"{table_name} {id} is in MySQL but not in MongoDB")
+                else:
+                    progress.mongo_scanned += 1
+                    progress.missing_in_mysql += 1
+                    result["missing_in_mysql"].append(id)
+                    logger.warning(f"{table_name} {id} is in MongoDB but not in MySQL")
+
+        with STAGE_SECONDS.time(stage="reconcile_range", table=table_name):
+            batches = chunked(matched_ids(), self.compare_chunk_size)
+            for batch, chunk in enumerate(batches, 1):
+                for id in self.iter_last_modified_mismatches(table_name, chunk):
+                    progress.last_modified_mismatches += 1
+                    result["last_modified_mismatches"].append(id)
+
+                # 扫描停在本批最后一个ID上，之前的缺失ID都已记录
+                if on_checkpoint is not None and batch % self.checkpoint_interval == 0:
+                    result["mysql_count"] = progress.mysql_scanned
+                    result["mongo_count"] = progress.mongo_scanned
+                    on_checkpoint(chunk[-1], result)
+
+        result["mysql_count"] = progress.mysql_scanned
+        result["mongo_count"] = progress.mongo_scanned
+        return result
+
+    def reconcile_parallel(
+        self, table_name, progress, workers=None, schedule_end_time=None
+    ):
+        """
+        把ID空间按最小/最大ID均分成 workers 段，每段在独立进程中用各自的数据库连接做归并扫描，
+        最后合并结果写入同一份报告。
+        """
+        workers = workers or self.parallel_workers
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        mysql_min, mysql_max = self.fetch_mysql_id_range(table_name)
+        mongo_min, mongo_max = self.fetch_mongo_id_range(table_name, schedule_end_time)
+        # 按数字区间拆分时查不到非数字 _id，单独查询一次，与全量模式一样记为只存在于 MongoDB
+        non_numeric_ids = self.fetch_mongo_non_numeric_ids(table_name, schedule_end_time)
+        bounds = [id for id in (mysql_min, mysql_max, mongo_min, mongo_max) if id is not None]
+        if not bounds and not non_numeric_ids:
+            return True
+
+        ranges = []
+        if bounds:
+            progress.min_id, progress.max_id = min(bounds), max(bounds)
+            step = -(-(progress.max_id + 1 - progress.min_id) // workers)
+            ranges = [
+                (lo, min(lo + step, progress.max_id + 1))
+                for lo in range(progress.min_id, progress.max_id + 1, step)
+            ]
+        logger.info(f"{table_name} reconcile {len(ranges)} ranges in parallel: {ranges}")
+
+        merged = {
+            "mysql_count": 0,
+            "mongo_count": len(non_numeric_ids),
+            "missing_in_mongo": [],
+            "missing_in_mysql": list(non_numeric_ids),
+            "last_modified_mismatches": [],
+        }
+        progress.mongo_scanned = merged["mongo_count"]
+        progress.missing_in_mysql = len(merged["missing_in_mysql"])
+        config = self.worker_config()
+        # pymongo 客户端不能跨 fork 使用，子进程用 spawn 启动
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(len(ranges), 1), mp_context=context) as executor:
+            futures = [
+                executor.submit(
+                    reconcile_range_worker,
+                    config,
+                    table_name,
+                    lo,
+                    hi,
+                    schedule_end_time,
+                )
+                for lo, hi in ranges
+            ]
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                merged["mysql_count"] += result["mysql_count"]
+                merged["mongo_count"] += result["mongo_count"]
+                for key in ("missing_in_mongo", "missing_in_mysql", "last_modified_mismatches"):
+                    merged[key].extend(result[key])
+
+                progress.mysql_scanned = merged["mysql_count"]
+                progress.mongo_scanned = merged["mongo_count"]
+                progress.missing_in_mongo = len(merged["missing_in_mongo"])
+                progress.missing_in_mysql = len(merged["missing_in_mysql"])
+                progress.last_modified_mismatches = len(merged["last_modified_mismatches"])
+                progress.last_id = progress.min_id + (
+                    progress.max_id - progress.min_id
+                ) * done // len(futures)
+
+        for key in ("missing_in_mongo", "missing_in_mysql", "last_modified_mismatches"):
+            merged[key].sort(key=id_sort_key)
+        merged = self.recheck_mismatches(table_name, merged, schedule_end_time, progress)
+        return self.write_reports(table_name, merged, ReconcileMode.parallel.value)
+
+    def worker_config(self):
+        """
+        在子进程中重建 SearchEngine 所需的配置。
+        """
+        return {
+            "mongodb_url": self.mongodb_url,
+            "mysql": {
+                "database": self.mysql_connector.database,
+                "host": self.mysql_connector.host,
+                "user": self.mysql_connector.user,
+                "password": self.mysql_connector.password,
+                "port": self.mysql_connector.port,
+            },
+            "compare_chunk_size": self.compare_chunk_size,
+            "mongo_batch_size": self.mongo_batch_size,
+        }
+
+    def open_report(self, table_name, kind):
+        return MismatchReport(self.report_dir, table_name, kind)
+
+    def write_reports(self, table_name, result, kind=ReconcileMode.full.value) -> bool:
+        with self.open_report(table_name, kind) as report:
+            report.summary["mysql_count"] = result["mysql_count"]
+            report.summary["mongo_count"] = result["mongo_count"]
+            report.summary["resolved_on_recheck"] = result.get("resolved_on_recheck", 0)
+            report.write_ids("missing_in_mongo", result["missing_in_mongo"])
+            report.write_ids("missing_in_mysql", result["missing_in_mysql"])
+            report.write_ids(
+                "last_modified_mismatch", result["last_modified_mismatches"]
+            )
+
+        ids_match = not result["missing_in_mongo"] and not result["missing_in_mysql"]
+        if ids_match:
+            logger.info("ID lists are completely matching.")
+        else:
+            logger.warning("ID lists are not matching.")
+        logger.info(f"{table_name} mismatch report written to {report.directory}")
         return ids_match
 
-    def fetch_mysql_data(
-        self, table_name, schedule_end_time=1736219420, batch_size=5000
+    def recheck_mismatches(self, table_name, result, schedule_end_time, progress=None):
+        """
+        扫描结束后按批重新查询所有疑似不一致的ID，两边同时查询，只保留仍然不一致的ID。
+        扫描期间被修改、删除或过期而造成的误报在这里被排除。
+
+        Returns:
+            dict: 与 result 结构相同，另有 resolved_on_recheck（排除的误报数量）。
+        """
+        suspected = list(
+            dict.fromkeys(
+                [
+                    *result["missing_in_mongo"],
+                    *result["missing_in_mysql"],
+                    *result["last_modified_mismatches"],
+                ]
+            )
+        )
+        confirmed = {
+            **result,
+            "missing_in_mongo": [],
+            "missing_in_mysql": [],
+            "last_modified_mismatches": [],
+        }
+        # 非数字的 MongoDB _id（字符串、ObjectId）无法按ID查询 MySQL，直接确认为只存在于 MongoDB
+        numeric_ids = []
+        for id in suspected:
+            if normalize_id(id) is None:
+                confirmed["missing_in_mysql"].append(id)
+            else:
+                numeric_ids.append(id)
+
+        for chunk in chunked(numeric_ids, self.compare_chunk_size):
+            with STAGE_SECONDS.time(stage="recheck", table=table_name):
+                mysql_rows, mongo_rows = self._run_concurrently(
+                    lambda: self.fetch_mysql_by_ids(table_name, chunk, schedule_end_time),
+                    lambda: self.fetch_mongo_by_ids(table_name, chunk, schedule_end_time),
+                )
+            for id in chunk:
+                if id in mysql_rows and id not in mongo_rows:
+                    confirmed["missing_in_mongo"].append(id)
+                elif id in mongo_rows and id not in mysql_rows:
+                    confirmed["missing_in_mysql"].append(id)
+                elif id in mysql_rows and mysql_rows[id] != mongo_rows[id]:
+                    confirmed["last_modified_mismatches"].append(id)
+
+        confirmed["resolved_on_recheck"] = len(suspected) - sum(
+            len(confirmed[key])
+            for key in ("missing_in_mongo", "missing_in_mysql", "last_modified_mismatches")
+        )
+        if suspected:
+            logger.info(
+                f"{table_name} rechecked {len(suspected)} suspected mismatches, {confirmed['resolved_on_recheck']} resolved"
+            )
+        if progress is not None:
+            progress.missing_in_mongo = len(confirmed["missing_in_mongo"])
+            progress.missing_in_mysql = len(confirmed["missing_in_mysql"])
+            progress.last_modified_mismatches = len(confirmed["last_modified_mismatches"])
+        return confirmed
+
+    def reconcile_changes(
+        self, table_name, watermark, progress, schedule_end_time=None
     ):
-        # 连接到MySQL数据库
+        """
+        只检查水位线之后在任意一边被修改过的ID。
+
+        Returns:
+            tuple: (ID是否一致, 新的水位线)
+        """
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        since = watermark - self.watermark_overlap
+        with STAGE_SECONDS.time(stage="fetch_changed_ids", table=table_name):
+            mysql_changed = self.fetch_mysql_changed_ids(table_name, since)
+            mongo_changed = self.fetch_mongo_changed_ids(table_name, since)
+        changed_ids = IdSet(list(mysql_changed)) | mongo_changed
+        logger.info(
+            f"{table_name} incremental check of {len(changed_ids)} ids changed since {since}"
+        )
 
-        cursor = self.mysql_connector.get_cursor()
+        if changed_ids:
+            # 转为 int：numpy.int64 无法被任务状态接口序列化为 JSON
+            progress.min_id, progress.max_id = changed_ids.array[[0, -1]].tolist()
+
+        mismatched_mysql = []
+        mismatched_mongo = []
+        mismatched_fields = []
+        for chunk in chunked(changed_ids, self.compare_chunk_size):
+            with STAGE_SECONDS.time(stage="compare_changed", table=table_name):
+                mysql_rows = self.fetch_mysql_by_ids(table_name, chunk, schedule_end_time)
+                mongo_rows = self.fetch_mongo_by_ids(table_name, chunk, schedule_end_time)
+            progress.mysql_scanned += len(mysql_rows)
+            progress.mongo_scanned += len(mongo_rows)
+            progress.last_id = chunk[-1]
+
+            for id in chunk:
+                if id in mysql_rows and id not in mongo_rows:
+                    mismatched_mysql.append(id)
+                elif id in mongo_rows and id not in mysql_rows:
+                    mismatched_mongo.append(id)
+                elif id in mysql_rows and mysql_rows[id] != mongo_rows[id]:
+                    mismatched_fields.append(id)
+
+            progress.missing_in_mongo = len(mismatched_mysql)
+            progress.missing_in_mysql = len(mismatched_mongo)
+            progress.last_modified_mismatches = len(mismatched_fields)
+
+        result = self.recheck_mismatches(
+            table_name,
+            {
+                "mysql_count": progress.mysql_scanned,
+                "mongo_count": progress.mongo_scanned,
+                "missing_in_mongo": mismatched_mysql,
+                "missing_in_mysql": mismatched_mongo,
+                "last_modified_mismatches": mismatched_fields,
+            },
+            schedule_end_time,
+            progress,
+        )
+        ids_match = self.write_reports(
+            table_name, result, ReconcileMode.incremental.value
+        )
+        return ids_match, max([watermark, *mysql_changed.values()])
+
+    def reconcile_checksums(
+        self,
+        table_name,
+        progress,
+        schedule_end_time=None,
+        leaf_size=1000,
+        fanout=16,
+    ):
+        """
+        按ID区间比较两边 (id, last_modified_time) 的行数和摘要，只对摘要不同的区间继续细分，
+        区间内行数不超过 leaf_size 时再逐行比较。两边基本一致时，传输量和耗时只与差异数量相关。
+        """
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        mysql_min, mysql_max = self.fetch_mysql_id_range(table_name)
+        mongo_min, mongo_max = self.fetch_mongo_id_range(table_name, schedule_end_time)
+        # 摘要只覆盖数字 _id，非数字 _id 单独查询一次，记为只存在于 MongoDB
+        non_numeric_ids = self.fetch_mongo_non_numeric_ids(table_name, schedule_end_time)
+        bounds = [id for id in (mysql_min, mysql_max, mongo_min, mongo_max) if id is not None]
+        if not bounds and not non_numeric_ids:
+            return True
+
+        mysql_total = 0
+        mongo_total = len(non_numeric_ids)
+        mismatched_mysql = []
+        mismatched_mongo = list(non_numeric_ids)
+        mismatched_fields = []
+        progress.mongo_scanned = mongo_total
+        progress.missing_in_mysql = len(mismatched_mongo)
+
+        # 深度优先，子区间按升序处理，便于用 last_id 估算进度
+        pending = []
+        if bounds:
+            progress.min_id, progress.max_id = min(bounds), max(bounds)
+            pending.append((progress.min_id, progress.max_id + 1))
+        while pending:
+            lo, hi = pending.pop()
+            step = max(1, -(-(hi - lo) // fanout))
+            with STAGE_SECONDS.time(stage="checksum_digests", table=table_name):
+                mysql_buckets = self.fetch_mysql_range_digests(
+                    table_name, lo, hi, step, schedule_end_time
+                )
+                mongo_buckets = self.fetch_mongo_range_digests(
+                    table_name, lo, hi, step, schedule_end_time
+                )
+
+            sub_ranges = []
+            for bucket in sorted(set(mysql_buckets) | set(mongo_buckets)):
+                mysql_count, mysql_digest = mysql_buckets.get(bucket, (0, 0))
+                mongo_count, mongo_digest = mongo_buckets.get(bucket, (0, 0))
+                bucket_lo = lo + bucket * step
+                bucket_hi = min(bucket_lo + step, hi)
+
+                if mysql_count == mongo_count and mysql_digest == mongo_digest:
+                    mysql_total += mysql_count
+                    mongo_total += mongo_count
+                    progress.last_id = bucket_hi - 1
+                elif max(mysql_count, mongo_count) <= leaf_size or step == 1:
+                    with STAGE_SECONDS.time(stage="checksum_rows", table=table_name):
+                        mysql_rows = self.fetch_mysql_range_rows(
+                            table_name, bucket_lo, bucket_hi, schedule_end_time
+                        )
+                        mongo_rows = self.fetch_mongo_range_rows(
+                            table_name, bucket_lo, bucket_hi, schedule_end_time
+                        )
+                    mysql_total += len(mysql_rows)
+                    mongo_total += len(mongo_rows)
+                    progress.last_id = bucket_hi - 1
+
+                    for id in sorted(set(mysql_rows) | set(mongo_rows)):
+                        if id not in mongo_rows:
+                            mismatched_mysql.append(id)
+                        elif id not in mysql_rows:
+                            mismatched_mongo.append(id)
+                        elif mysql_rows[id] != mongo_rows[id]:
+                            mismatched_fields.append(id)
+                else:
+                    sub_ranges.append((bucket_lo, bucket_hi))
+
+            pending.extend(reversed(sub_ranges))
+            progress.mysql_scanned = mysql_total
+            progress.mongo_scanned = mongo_total
+            progress.missing_in_mongo = len(mismatched_mysql)
+            progress.missing_in_mysql = len(mismatched_mongo)
+            progress.last_modified_mismatches = len(mismatched_fields)
+        progress.last_id = progress.max_id
+
+        result = self.recheck_mismatches(
+            table_name,
+            {
+                "mysql_count": mysql_total,
+                "mongo_count": mongo_total,
+                "missing_in_mongo": mismatched_mysql,
+                "missing_in_mysql": mismatched_mongo,
+                "last_modified_mismatches": mismatched_fields,
+            },
+            schedule_end_time,
+            progress,
+        )
+        return self.write_reports(table_name, result, ReconcileMode.checksum.value)
+
+    def fetch_mysql_range_digests(self, table_name, lo, hi, step, schedule_end_time):
+        """
+        Returns:
+            dict: {bucket: (行数, 摘要)}，bucket 为 (id - lo) // step。
+        """
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        query = range_digest_sql.format(table=table_name)
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(query, (lo, step, schedule_end_time, lo, hi))
+            return {
+                int(row[0]): (int(row[1]), int(row[2])) for row in cursor.fetchall()
+            }
 
-        last_id = None
-        mysql_ids = set()
+    def fetch_mongo_range_digests(self, table_name, lo, hi, step, schedule_end_time):
+        collection = self._get_collection(table_name)
+        # 与 range_digest_sql 相同的摘要公式
+        hashed = {
+            "$mod": [
+                {
+                    "$add": [
+                        {"$multiply": ["$_id", 2654435761]},
+                        {"$ifNull": ["$last_modified_time", 0]},
+                    ]
+                },
+                2147483647,
+            ]
+        }
+        pipeline = [
+            {"$match": self._mongo_live_query(schedule_end_time, lo, hi)},
+            {
+                "$project": {
+                    "bucket": {"$floor": {"$divide": [{"$subtract": ["$_id", lo]}, step]}},
+                    "hashed": hashed,
+                }
+            },
+            {
+                "$group": {
+                    "_id": "$bucket",
+                    "row_count": {"$sum": 1},
+                    "digest": {
+                        "$sum": {
+                            "$mod": [{"$multiply": ["$hashed", "$hashed"]}, 2147483647]
+                        }
+                    },
+                }
+            },
+        ]
+        return {
+            int(doc["_id"]): (int(doc["row_count"]), int(doc["digest"]))
+            for doc in collection.aggregate(pipeline)
+        }
+
+    def fetch_mysql_range_rows(self, table_name, lo, hi, schedule_end_time):
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        query = f"SELECT {table_name}_id, last_modified_time FROM {table_name} WHERE is_deleted = 0 AND schedule_end_time > %s AND {table_name}_id >= %s AND {table_name}_id < %s"
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(query, (schedule_end_time, lo, hi))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def fetch_mongo_range_rows(self, table_name, lo, hi, schedule_end_time):
+        collection = self._get_collection(table_name)
+        cursor = collection.find(
+            self._mongo_live_query(schedule_end_time, lo, hi),
+            projection={"_id": 1, "last_modified_time": 1},
+            batch_size=self.mongo_batch_size,
+        )
+        return {
+            normalize_id(doc["_id"]): doc.get("last_modified_time") for doc in cursor
+        }
+
+    def fetch_mongo_id_range(self, table_name, schedule_end_time=None):
+        """
+        Returns:
+            tuple: (最小 _id, 最大 _id)，只统计数字类型的 _id。
+        """
+        collection = self._get_collection(table_name)
+        query = self._mongo_live_query(self.resolve_snapshot_time(schedule_end_time))
+        query["_id"] = {"$type": "number"}
+        bounds = []
+        for direction in (1, -1):
+            docs = list(
+                collection.find(query, projection={"_id": 1})
+                .sort("_id", direction)
+                .limit(1)
+            )
+            bounds.append(normalize_id(docs[0]["_id"]) if docs else None)
+        return tuple(bounds)
+
+    def fetch_mongo_non_numeric_ids(self, table_name, schedule_end_time=None):
+        """
+        Returns:
+            list: 在线文档中非数字类型的 _id（字符串、ObjectId 等），按ID区间扫描时查不到它们。
+        """
+        collection = self._get_collection(table_name)
+        query = self._mongo_live_query(self.resolve_snapshot_time(schedule_end_time))
+        query["_id"] = {"$not": {"$type": "number"}}
+        ids = [doc["_id"] for doc in collection.find(query, projection={"_id": 1})]
+        if ids:
+            logger.warning(
+                f"{table_name} has {len(ids)} non-numeric _id in MongoDB: {ids}"
+            )
+        return ids
+
+    def fetch_mysql_changed_ids(self, table_name, since):
+        """
+        Returns:
+            dict: {id: last_modified_time}，last_modified_time 大于 since 的所有行（含已删除/已过期）。
+            需要 last_modified_time 上的索引，见 check_mysql_indexes。
+        """
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        query = f"SELECT {table_name}_id, last_modified_time FROM {table_name} WHERE last_modified_time > %s"
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(query, (since,))
+            return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def fetch_mongo_changed_ids(self, table_name, since):
+        """
+        查询只投影 _id，由 MONGO_CHANGED_INDEX 覆盖。
+        """
+        collection = self._get_collection(table_name)
+        cursor = collection.find(
+            {"last_modified_time": {"$gt": since}}, projection={"_id": 1}
+        )
+        return IdSet.from_iterable(
+            id
+            for id in (normalize_id(doc["_id"]) for doc in cursor)
+            if id is not None
+        )
 
+    def fetch_mysql_max_last_modified_time(self, table_name):
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(f"SELECT MAX(last_modified_time) FROM {table_name}")
+            return cursor.fetchall()[0][0]
+
+    def fetch_mysql_id_range(self, table_name):
+        """
+        Returns:
+            tuple: (最小ID, 最大ID)，表为空时为 (None, None)。
+        """
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        with self.mysql_connector.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN({table_name}_id), MAX({table_name}_id) FROM {table_name}"
+            )
+            return tuple(cursor.fetchall()[0])
+
+    def iter_mysql_ids(
+        self,
+        table_name,
+        schedule_end_time=None,
+        batch_size=5000,
+        lo=None,
+        hi=None,
+    ):
+        """
+        按ID升序分页（keyset）扫描MySQL，逐个返回ID。
+        lo/hi 限定扫描区间 [lo, hi)，为 None 时不限。
+        连接中断等临时错误时退避后换一个连接，从最后一个ID继续。
+        """
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        last_id = None
+        failures = 0
         while True:
-            # 构建查询语句
-            if last_id is None:
-                query = f"SELECT {table_name}_id FROM {table_name} WHERE is_deleted = 0 AND schedule_end_time > {schedule_end_time} ORDER BY {table_name}_id ASC LIMIT %s"
-                params = (batch_size,)
-            else:
-                query = f"SELECT {table_name}_id FROM {table_name} WHERE {table_name}_id > %s and is_deleted = 0 AND schedule_end_time > {schedule_end_time} ORDER BY {table_name}_id ASC LIMIT %s"
-                params = (last_id, batch_size)
+            try:
+                # 整个扫描过程占用连接池中的一个连接
+                with self.mysql_connector.cursor() as cursor:
+                    while True:
+                        # 构建查询语句
+                        conditions = [
+                            "is_deleted = 0",
+                            f"schedule_end_time > {schedule_end_time}",
+                        ]
+                        params = []
+                        if last_id is not None:
+                            conditions.append(f"{table_name}_id > %s")
+                            params.append(last_id)
+                        elif lo is not None:
+                            conditions.append(f"{table_name}_id >= %s")
+                            params.append(lo)
+                        if hi is not None:
+                            conditions.append(f"{table_name}_id < %s")
+                            params.append(hi)
+                        params.append(batch_size)
+
+                        query = f"SELECT {table_name}_id FROM {table_name} WHERE {' AND '.join(conditions)} ORDER BY {table_name}_id ASC LIMIT %s"
+                        with STAGE_SECONDS.time(stage="scan_mysql_ids", table=table_name):
+                            cursor.execute(query, tuple(params))
+
+                            # 获取结果
+                            results = cursor.fetchall()
+                        if not results:
+                            return
+
+                        failures = 0
+                        last_id = results[-1][0]
+                        for row in results:
+                            yield row[0]
+            except TRANSIENT_ERRORS as e:
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                delay = backoff_delay(failures, self.retry_base_delay)
+                logger.warning(
+                    f"{table_name} MySQL scan failed after id {last_id}, retrying in {delay:.2f}s: {e}"
+                )
+                time.sleep(delay)
+
+    def iter_mongo_ids(
+        self,
+        table_name,
+        schedule_end_time=None,
+        batch_size=None,
+        lo=None,
+        hi=None,
+    ):
+        """
+        按 _id 升序扫描MongoDB，逐个返回 _id。
+        lo/hi 限定扫描区间 [lo, hi)，为 None 时不限。
+
+        只用一个游标，按 batch_size（默认 mongo_batch_size）分批拉取；
+        查询只投影 _id，由 MONGO_SCAN_INDEX 覆盖，不读取文档本身。
+        游标在服务端超时失效时，从最后一个 _id 重新打开。
+        """
+        collection = self._get_collection(table_name)
+        batch_size = batch_size or self.mongo_batch_size
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
 
-            # 构建查询语句
-            cursor.execute(query, params)
+        last_id = None
+        failures = 0
+        while True:
+            query = self._mongo_live_query(
+                schedule_end_time, lo if last_id is None else None, hi
+            )
+            if last_id is not None:
+                query.setdefault("_id", {})["$gt"] = last_id
+            cursor = collection.find(
+                query, projection={"_id": 1}, batch_size=batch_size
+            ).sort("_id", 1)
+            try:
+                # 只统计等待游标的时间（不含调用方处理），每 batch_size 个 _id 记录一次
+                documents = iter(cursor)
+                fetched = 0
+                waited = 0.0
+                while True:
+                    started = time.perf_counter()
+                    doc = next(documents, None)
+                    waited += time.perf_counter() - started
+                    if doc is None:
+                        break
+                    last_id = doc["_id"]
+                    failures = 0
+                    yield last_id
+                    fetched += 1
+                    if fetched == batch_size:
+                        STAGE_SECONDS.observe(waited, stage="scan_mongo_ids", table=table_name)
+                        fetched, waited = 0, 0.0
+                if fetched:
+                    STAGE_SECONDS.observe(waited, stage="scan_mongo_ids", table=table_name)
+                return
+            except CursorNotFound:
+                logger.warning(
+                    f"{table_name} MongoDB cursor expired, resuming after _id {last_id}"
+                )
+            except AutoReconnect as e:
+                failures += 1
+                if failures > self.max_retries:
+                    raise
+                delay = backoff_delay(failures, self.retry_base_delay)
+                logger.warning(
+                    f"{table_name} MongoDB scan failed after _id {last_id}, retrying in {delay:.2f}s: {e}"
+                )
+                time.sleep(delay)
+            finally:
+                cursor.close()
+
+    def reconcile_ids(
+        self,
+        table_name,
+        schedule_end_time=None,
+        batch_size=5000,
+        lo=None,
+        hi=None,
+    ):
+        """
+        对两边升序的ID流做归并，边扫描边返回结果。
+
+        MongoDB 的 _id 通过 normalize_id 转为整数；无法转换的 _id 以原值作为 "mongo" 返回。
+
+        Yields:
+            tuple: (side, id)，side 为 "both"、"mysql"（仅MySQL有）或 "mongo"（仅MongoDB有）。
+        """
+        # 两边使用同一个快照时间；分别在后台线程中预取，MySQL 和 MongoDB 扫描同时进行
+        schedule_end_time = self.resolve_snapshot_time(schedule_end_time)
+        mysql_iter = prefetch(
+            self.iter_mysql_ids(table_name, schedule_end_time, batch_size, lo, hi),
+            batch_size=batch_size,
+        )
+        mongo_iter = prefetch(
+            self.iter_mongo_ids(table_name, schedule_end_time, None, lo, hi),
+            batch_size=batch_size,
+        )
 
-            # 获取结果
-            results = cursor.fetchall()
-            if not results:
-                break
+        def next_mongo_id():
+            # 非数字类型的 _id 无法按整数ID查到，直接视为仅MongoDB存在
+            for id in mongo_iter:
+                normalized = normalize_id(id)
+                if normalized is not None:
+                    return normalized
+                invalid_mongo_ids.append(id)
+            return None
 
-            for row in results:
-                last_id = row[0]
-                mysql_ids.add(str(row[0]))  # 将ID转换为字符串，以匹配MongoDB的ID格式
+        invalid_mongo_ids = []
+        mysql_id = next(mysql_iter, None)
+        mongo_id = next_mongo_id()
+        while mysql_id is not None or mongo_id is not None:
+            while invalid_mongo_ids:
+                yield "mongo", invalid_mongo_ids.pop()
+            if mongo_id is None or (mysql_id is not None and mysql_id < mongo_id):
+                yield "mysql", mysql_id
+                mysql_id = next(mysql_iter, None)
+            elif mysql_id is None or mongo_id < mysql_id:
+                yield "mongo", mongo_id
+                mongo_id = next_mongo_id()
+            else:
+                yield "both", mysql_id
+                mysql_id = next(mysql_iter, None)
+                mongo_id = next_mongo_id()
+        while invalid_mongo_ids:
+            yield "mongo", invalid_mongo_ids.pop()
 
-        cursor.close()
-        return mysql_ids
+    def fetch_mysql_data(
+        self, table_name, schedule_end_time=None, batch_size=5000
+    ):
+        with STAGE_SECONDS.time(stage="fetch_ids", table=table_name):
+            return IdSet.from_iterable(
+                self.iter_mysql_ids(table_name, schedule_end_time, batch_size)
+            )
 
     def fetch_mysql_by_id(self, table_name, id):
-        cursor = self.mysql_connector.get_cursor()
         query = None
         params = (id,)
 
@@ -119,22 +1214,19 @@ class SearchEngine:
         if query is None:
             return None
         try:
-            cursor.execute(query, params)
-            results = cursor.fetchall()
+            with self.mysql_connector.cursor() as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall()
             if not results:
                 return None
             return results[0]
         except Exception as e:
             return None
-        finally:
-            cursor.close()
 
 
     def fetch_mongo_by_id(self, table_name, id):
         # 获取对应的collection
-        collection = getattr(self, f"{table_name}_collection", None)
-        if collection is None:
-            raise ValueError(f"Invalid table name: {table_name}")
+        collection = self._get_collection(table_name)
 
         # 构建查询条件
         query = {"_id": id}
@@ -148,208 +1240,575 @@ class SearchEngine:
 
 
     def fetch_mongo_data(
-        self, table_name, schedule_end_time=1736219420, batch_size=5000
+        self, table_name, schedule_end_time=None, batch_size=None
     ):
-
-        last_id = None
-        mongo_ids = set()
-
-        while True:
-            # 构建查询条件
-            query = {
-                "is_deleted": 0,
-                "schedule_end_time": {"$gt": schedule_end_time},
-                "_id": {"$gt": last_id},
-            }
-            if last_id == None:
-                if table_name == "product":
-                    cursor = (
-                        self.product_collection.find(
-                            {
-                                "is_deleted": 0,
-                                "schedule_end_time": {"$gt": schedule_end_time},
-                            },
-                            projection={"_id": 1},
-                        )
-                        .sort("_id", 1)
-                        .limit(batch_size)
-                    )
-                elif table_name == "series":
-                    cursor = (
-                        self.series_collection.find(
-                            {
-                                "is_deleted": 0,
-                                "schedule_end_time": {"$gt": schedule_end_time},
-                            },
-                            projection={"_id": 1},
-                        )
-                        .sort("_id", 1)
-                        .limit(batch_size)
-                    )
-            else:
-                if table_name == "product":
-                    cursor = (
-                        self.product_collection.find(query, projection={"_id": 1})
-                        .sort("_id", 1)
-                        .limit(batch_size)
-                    )
-                elif table_name == "series":
-                    cursor = (
-                        self.series_collection.find(query, projection={"_id": 1})
-                        .sort("_id", 1)
-                        .limit(batch_size)
-                    )
-            results = list(cursor)
-
-            if not results:
-                break
-
-            for doc in results:
-                last_id = doc["_id"]
-                mongo_ids.add(str(doc["_id"]))  # 将ID转换为字符串，以匹配MySQL的ID格式
-
+        invalid_ids = []
+
+        def normalized_ids():
+            for id in self.iter_mongo_ids(table_name, schedule_end_time, batch_size):
+                normalized = normalize_id(id)
+                if normalized is None:
+                    invalid_ids.append(id)
+                else:
+                    yield normalized
+
+        with STAGE_SECONDS.time(stage="fetch_ids", table=table_name):
+            mongo_ids = IdSet.from_iterable(normalized_ids())
+        if invalid_ids:
+            logger.warning(
+                f"{table_name} has {len(invalid_ids)} non-numeric _id in MongoDB: {invalid_ids}"
+            )
         return mongo_ids
 
-    def compare_fields(self, table_name, mysql_ids):
-        logger.info("compare fields start !")
-        count = 0
-        for id in mysql_ids:
-            row_in_mysql = self.fetch_mysql_by_id(table_name, id)
-            if row_in_mysql is None:
-                continue
+    def fetch_mysql_by_ids(self, table_name, ids, schedule_end_time=None):
+        """
+        批量获取一组ID的 last_modified_time。
+        传入 schedule_end_time 时只返回未删除且未过期的行。
 
-            row_in_mongo = self.fetch_mongo_by_id(table_name, id)
-            if row_in_mongo is None:
-                continue
+        Returns:
+            dict: {id: last_modified_time}，不存在的ID不会出现在结果中。
+        """
+        if table_name not in ("product", "series"):
+            raise ValueError(f"Invalid table name: {table_name}")
+        if not ids:
+            return {}
+
+        placeholders = ",".join(["%s"] * len(ids))
+        query = f"SELECT {table_name}_id, last_modified_time FROM {table_name} WHERE {table_name}_id IN ({placeholders})"
+        params = tuple(ids)
+        if schedule_end_time is not None:
+            query += " AND is_deleted = 0 AND schedule_end_time > %s"
+            params += (schedule_end_time,)
+
+        def fetch():
+            with self.mysql_connector.cursor() as cursor:
+                cursor.execute(query, params)
+                return {row[0]: row[1] for row in cursor.fetchall()}
+
+        return self._retry(fetch)
+
+    def fetch_mongo_by_ids(self, table_name, ids, schedule_end_time=None):
+        """
+        批量获取一组ID在MongoDB中的 last_modified_time。
+        传入 schedule_end_time 时只返回未删除且未过期的文档。
+
+        Returns:
+            dict: {_id: last_modified_time}，不存在的ID不会出现在结果中。
+        """
+        collection = self._get_collection(table_name)
+        if not ids:
+            return {}
+
+        query = {"_id": {"$in": list(ids)}}
+        if schedule_end_time is not None:
+            query["is_deleted"] = 0
+            query["schedule_end_time"] = {"$gt": schedule_end_time}
+
+        def fetch():
+            cursor = collection.find(
+                query,
+                projection={"_id": 1, "last_modified_time": 1},
+                batch_size=len(ids),
+            )
+            return {doc["_id"]: doc.get("last_modified_time") for doc in cursor}
+
+        return self._retry(fetch)
+
+    def iter_last_modified_mismatches(self, table_name, ids, chunk_size=None):
+        """
+        按批比较两边都存在的ID的 last_modified_time，逐个返回不一致的ID。
+        """
+        if chunk_size is None:
+            chunk_size = self.compare_chunk_size
+
+        for chunk in chunked((int(id) for id in ids), chunk_size):
+            with STAGE_SECONDS.time(stage="compare_fields", table=table_name):
+                mysql_rows = self.fetch_mysql_by_ids(table_name, chunk)
+                mongo_rows = self.fetch_mongo_by_ids(table_name, chunk)
+                mismatched = [
+                    id
+                    for id in chunk
+                    if id in mysql_rows
+                    and id in mongo_rows
+                    and mysql_rows[id] != mongo_rows[id]
+                ]
+            yield from mismatched
+
+    def compare_fields(self, table_name, mysql_ids, chunk_size=None, progress=None):
+        logger.info("compare fields start !")
 
-            if row_in_mongo.last_modified_time == row_in_mysql.last_modified_time:
-                continue
+        # 不一致的ID边比较边写入报告
+        with self.open_report(table_name, "compare_fields") as report:
+            for id in self.iter_last_modified_mismatches(
+                table_name, mysql_ids, chunk_size
+            ):
+                report.write("last_modified_mismatch", id)
+                if progress is not None:
+                    progress.last_modified_mismatches = report.counts[
+                        "last_modified_mismatch"
+                    ]
+
+        logger.info(
+            f"compare fields end ! {report.counts['last_modified_mismatch']} mismatches written to {report.directory}"
+        )
 
-            count = count + 1
-            filename = f"{table_name}_last_modified_time_mismatch.txt"
-            with open(filename, "a") as file:
-                file.write(f"{id}\n")
+    def compare_ids(self, table_name, mysql_ids, mongo_ids):
+        with STAGE_SECONDS.time(stage="compare_ids", table=table_name):
+            ids_match = mysql_ids == mongo_ids
+            with self.open_report(table_name, "compare_ids") as report:
+                report.summary["mysql_count"] = len(mysql_ids)
+                report.summary["mongo_count"] = len(mongo_ids)
+                if not ids_match:
+                    report.write_ids("missing_in_mongo", mysql_ids - mongo_ids)
+                    report.write_ids("missing_in_mysql", mongo_ids - mysql_ids)
+            if ids_match:
+                logger.info("ID lists are completely matching.")
+            else:
+                logger.warning(
+                    f"ID lists are not matching, report written to {report.directory}"
+                )
+        return ids_match
 
+    def iter_etl_query(self, sql_template, ids, snapshot_time=None, groups=None):
+        """
+        把ID按固定大小分批，用预处理语句执行ETL SQL，并在连接池的多个连接上并发执行，
+        按批次顺序逐行返回结果，同时最多只保留与连接数相同的批次在内存中。
 
-        filename = f"{table_name}_last_modified_time_mismatch_count.txt"
-        with open(filename, "w") as file:
-            file.write(f"{table_name} mismatch count: {count}  (last_modified)\n")
+        不足一批的批次用最后一个ID补齐到固定长度，保证所有批次的SQL文本相同、数据包大小恒定，
+        每个连接上的预处理语句可以重复使用。
+        SQL 中的 {snapshot_time} 替换为快照时间，所有批次使用同一个时间。
 
-        logger.info("compare fields end !")
+        groups 为覆盖全部ID的分组（如同一 ccs_series_id 的 series），同组的ID不会被分到
+        不同批次；超过批大小的组单独成批。
+        """
+        ids = sorted(set(ids))
+        if not ids:
+            return
 
-    def compare_ids(self, table_name, mysql_ids, mongo_ids):
-        if mysql_ids != mongo_ids:
-            logger.warning("ID lists are not matching.")
-            mismatched_mysql = mysql_ids - mongo_ids
-            mismatched_mongo = mongo_ids - mysql_ids
-            # 将不匹配的ID写入文本文件
-            filename = f"{table_name}_id_mismatch.txt"
-            with open(filename, "w") as file:
-                file.write(f"mysql_ids count: {len(mysql_ids)}\n")
-                file.write(f"mongo_ids count: {len(mongo_ids)}\n")
-                file.write(f"MySQL IDs not in MongoDB count: {len(mismatched_mysql)}\n")
-                file.write(f"MySQL IDs not in MongoDB:\n{mismatched_mysql}\n\n")
-                file.write(f"\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n\n")
-                file.write(f"MongoDB IDs not in MySQL count: {len(mismatched_mongo)}\n")
-                file.write(f"MongoDB IDs not in MySQL:\n{mismatched_mongo}\n")
+        chunk_size = min(self.etl_chunk_size, len(ids))
+        slots = sql_template.count("{}")
+        snapshot_time = self.resolve_snapshot_time(snapshot_time)
+
+        def make_sql(size):
+            placeholders = ",".join(["%s"] * size)
+            return sql_template.format(
+                *([placeholders] * slots), snapshot_time=snapshot_time
+            )
+
+        sql = make_sql(chunk_size)
+
+        def run(chunk):
+            size = max(chunk_size, len(chunk))
+            chunk = chunk + [chunk[-1]] * (size - len(chunk))
+            return list(
+                self.mysql_connector.iter_query(
+                    sql if size == chunk_size else make_sql(size),
+                    tuple(chunk) * slots,
+                    prepared=True,
+                )
+            )
+
+        if groups is None:
+            chunks = chunked(ids, chunk_size)
         else:
-            logger.info("ID lists are completely matching.")
-        return mysql_ids == mongo_ids
-
-    def series_etl(self, series_ids: List[int]):
+            chunks = chunked_groups(groups, chunk_size)
+
+        workers = min(-(-len(ids) // chunk_size), self.mysql_connector.pool_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(run, chunk))
+                if len(pending) >= workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+
+    def iter_series_etl(self, series_ids: List[int], snapshot_time=None):
+        logger.info(f"Series ETL for {len(series_ids)} ids")
+
+        if self.dimension_cache is None:
+            # series_sql 按批内的 ccs_series_id 聚合，同组的 series 必须在同一批
+            rows = self.iter_etl_query(
+                series_sql,
+                series_ids,
+                snapshot_time,
+                groups=self.series_ccs_groups(series_ids),
+            )
+        else:
+            rows = self.iter_series_rows_from_dimensions(series_ids, snapshot_time)
+
+        for row in rows:
+            yield normalize_document("series", row)
+
+    def series_ccs_groups(self, series_ids):
+        """
+        把 series_ids 分组：共享任一 ccs_series_id 的 series 在同一组，没有关系的单独成组。
+        """
+        parent = {id: id for id in set(series_ids)}
+
+        def find(id):
+            while parent[id] != id:
+                parent[id] = parent[parent[id]]
+                id = parent[id]
+            return id
+
+        first_by_ccs = {}
+        for row in self.iter_etl_query(series_ccs_relation_sql, series_ids):
+            series_id = row["series_id"]
+            other = first_by_ccs.setdefault(row["ccs_series_id"], series_id)
+            parent[find(series_id)] = find(other)
+
+        groups = defaultdict(list)
+        for id in sorted(parent):
+            groups[find(id)].append(id)
+        return list(groups.values())
+
+    def iter_series_rows_from_dimensions(self, series_ids: List[int], snapshot_time=None):
+        """
+        与 series_sql 结果相同的行：只从MySQL查询基础行和关系ID，
+        演员、标签名称来自维度缓存，按 ccs_series_id 聚合的字段在内存中拼装。
+        """
+        actor_names = self.dimension_cache.names("tag_actor")
+        tag_names = self.dimension_cache.names("tag")
+
+        base_rows = list(self.iter_etl_query(series_base_sql, series_ids, snapshot_time))
+
+        ccs_ids_by_series = defaultdict(list)
+        series_ids_by_ccs = defaultdict(list)
+        for row in self.iter_etl_query(series_ccs_relation_sql, series_ids):
+            ccs_ids_by_series[row["series_id"]].append(row["ccs_series_id"])
+            series_ids_by_ccs[row["ccs_series_id"]].append(row["series_id"])
+
+        actors_by_ccs = defaultdict(set)
+        for row in self.iter_etl_query(series_actor_relation_sql, series_ids):
+            name = actor_names.get(row["tag_actor_id"])
+            if name is None:
+                continue
+            for ccs_series_id in ccs_ids_by_series.get(row["series_id"], []):
+                actors_by_ccs[ccs_series_id].add(name)
+
+        tags_by_series = defaultdict(set)
+        for row in self.iter_etl_query(series_tag_relation_sql, series_ids):
+            name = tag_names.get(row["tag_id"])
+            if name is not None:
+                tags_by_series[row["series_id"]].add(name)
+
+        # keyword / alternative_names 按 ccs_series_id 聚合在线的 series
+        keywords_by_ccs = defaultdict(set)
+        alternative_names_by_ccs = defaultdict(set)
+        for row in base_rows:
+            for ccs_series_id in ccs_ids_by_series.get(row["series_id"], []):
+                if row["keyword"] is not None:
+                    keywords_by_ccs[ccs_series_id].add(row["keyword"])
+                if row["series_name_lower"] is not None:
+                    alternative_names_by_ccs[ccs_series_id].add(row["series_name_lower"])
+
+        def group_concat(values):
+            return ",".join(values) if values else None
+
+        for base_row in base_rows:
+            tag_names_str = group_concat(tags_by_series.get(base_row["series_id"]))
+            for ccs_series_id in ccs_ids_by_series.get(base_row["series_id"]) or [None]:
+                row = dict(base_row)
+                row["keyword"] = group_concat(keywords_by_ccs.get(ccs_series_id))
+                row["ccs_series_id"] = ccs_series_id
+                row["actor_names"] = group_concat(actors_by_ccs.get(ccs_series_id))
+                row["alternative_names"] = group_concat(
+                    alternative_names_by_ccs.get(ccs_series_id)
+                )
+                row["tag_names"] = tag_names_str
+                yield row
+
+    def series_etl(self, series_ids: List[int], snapshot_time=None):
 
         if not series_ids:
             return
 
-        # 处理ids
-        # 直接将类型注解转换为字符串
-        list_type_str = str(series_ids.series_ids)
-
-        # 去掉字符串中的中括号
-        series_ids_str = list_type_str.replace("[", "").replace("]", "")
+        with STAGE_SECONDS.time(stage="etl", table="series"):
+            return list(self.iter_series_etl(series_ids, snapshot_time))
 
-        logger.info(f"Series with below ids will be updated: {series_ids_str}")
+    def iter_product_etl(self, product_ids: List[int], snapshot_time=None):
+        logger.info(f"product ETL for {len(product_ids)} ids")
 
-        series_etl_sql = series_sql.format(
-            series_ids_str, series_ids_str, series_ids_str, series_ids_str
-        )
+        if self.dimension_cache is None:
+            rows = self.iter_etl_query(product_sql, product_ids, snapshot_time)
+        else:
+            rows = self.iter_product_rows_from_dimensions(product_ids, snapshot_time)
 
-        series_data = self.mysql_connector.query(series_etl_sql)
+        for row in rows:
+            yield normalize_document("product", row)
 
-        fields_to_split = ["keyword", "actor_names", "alternative_names", "tag_names"]
+    def iter_product_rows_from_dimensions(self, product_ids: List[int], snapshot_time=None):
+        """
+        与 product_sql 结果相同的行：guest_tag_names 由关系ID和维度缓存在内存中拼装。
+        """
+        guest_tag_names = self.dimension_cache.names("tag_guest")
 
-        for row in series_data:
-            for field in fields_to_split:
-                if row[field]:
-                    row[field] = [word.strip() for word in set(row[field].split(","))]
+        guest_tags_by_product = defaultdict(list)
+        for row in self.iter_etl_query(product_tag_relation_sql, product_ids):
+            name = guest_tag_names.get(row["tag_id"])
+            if name is not None:
+                guest_tags_by_product[row["product_id"]].append(name)
 
-        return series_data
+        for row in self.iter_etl_query(product_base_sql, product_ids, snapshot_time):
+            names = guest_tags_by_product.get(row["product_id"])
+            row["guest_tag_names"] = ",".join(names) if names else None
+            yield row
 
-    def product_etl(self, product_ids: List[int]):
+    def product_etl(self, product_ids: List[int], snapshot_time=None):
 
         if not product_ids:
             return
 
-        # 处理ids
-        # 直接将类型注解转换为字符串
-        list_type_str = str(product_ids.product_ids)
-
-        # 去掉字符串中的中括号
-        product_ids_str = list_type_str.replace("[", "").replace("]", "")
-
-        logger.info(f"product with below ids will be updated: {product_ids_str}")
+        with STAGE_SECONDS.time(stage="etl", table="product"):
+            return list(self.iter_product_etl(product_ids, snapshot_time))
+
+    def fetch_mongo_documents(self, table_name, ids, schedule_end_time=None):
+        """
+        传入 schedule_end_time 时只返回未删除且未过期的文档。
+        """
+        collection = self._get_collection(table_name)
+        query = {"_id": {"$in": list(ids)}}
+        if schedule_end_time is not None:
+            query["is_deleted"] = 0
+            query["schedule_end_time"] = {"$gt": schedule_end_time}
+        cursor = collection.find(query, batch_size=len(ids))
+        # 列表字段与ETL一样转换为规范形式
+        return [normalize_document(table_name, doc) for doc in cursor]
+
+    def iter_product_differences(self, product_ids, chunk_size=None, snapshot_time=None):
+        """
+        按批对商品做全字段比较：每批的 product_etl 和 MongoDB $in 查询并发执行，
+        并提前提交下一批，逐批返回差异，不在内存中保留全部结果。
+
+        Yields:
+            tuple: (本批ID列表, 本批的ETL行数, 本批的MongoDB文档数, differences)
+        """
+        if chunk_size is None:
+            chunk_size = self.document_chunk_size
+        # 所有批次的ETL使用同一个快照时间
+        snapshot_time = self.resolve_snapshot_time(snapshot_time)
+
+        def submit(chunk):
+            return (
+                chunk,
+                executor.submit(self.product_etl, chunk, snapshot_time),
+                # MongoDB 端同样只取该快照时间下在线的文档，与ETL一致
+                executor.submit(
+                    self.fetch_mongo_documents, "product", chunk, snapshot_time
+                ),
+            )
+
+        def diff(chunk, mysql_future, mongo_future):
+            mysql_data = mysql_future.result() or []
+            mongo_data = mongo_future.result()
+            with STAGE_SECONDS.time(stage="diff", table="product"):
+                differences = self.compare_objects_by_id(mysql_data, mongo_data)
+            return chunk, len(mysql_data), len(mongo_data), differences
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            pending = deque()
+            for chunk in chunked(product_ids, chunk_size):
+                pending.append(submit(chunk))
+                if len(pending) > 1:
+                    yield diff(*pending.popleft())
+            while pending:
+                yield diff(*pending.popleft())
+
+    def validate_product_documents(self, product_ids, progress=None):
+        """
+        后台任务入口：逐批比较商品全字段，差异按行写入 JSONL 文件。
+        """
+        if progress is None:
+            progress = ReconcileProgress()
+        progress.min_id, progress.max_id, progress.last_id = 0, len(product_ids), 0
+
+        checked = 0
+        mismatched = 0
+        with self.open_report("product", "documents") as report:
+            for chunk, mysql_count, mongo_count, differences in self.iter_product_differences(
+                product_ids
+            ):
+                checked += len(chunk)
+                mismatched += len(differences)
+                progress.last_id = checked
+                progress.mysql_scanned += mysql_count
+                progress.mongo_scanned += mongo_count
+                progress.document_mismatches = mismatched
+                for id_, diffs in differences.items():
+                    existence = diffs.get("existence")
+                    if existence and existence["mysql"]:
+                        progress.missing_in_mongo += 1
+                    elif existence:
+                        progress.missing_in_mysql += 1
+                    report.write("document_mismatch", id_, differences=diffs)
+            report.summary["checked"] = checked
+
+        logger.info(f"product documents checked: {checked}, mismatched: {mismatched}")
+        return {"checked": checked, "mismatched": mismatched, "report": report.directory}
+
+    def expand_ccs_groups(self, series_ids):
+        """
+        series_ids 加上与它们属于同一 ccs_series_id 的全部 series。
+        """
+        related = [
+            row["series_id"]
+            for row in self.iter_etl_query(series_ids_by_ccs_group_sql, series_ids)
+        ]
+        return list(dict.fromkeys([*series_ids, *related]))
+
+    def etl(self, table_name, ids, snapshot_time=None):
+        """
+        只返回 ids 的ETL结果。series 的 keyword/actor_names/alternative_names 按
+        ccs_series_id 聚合输入的全部 series，所以先把同组的 series 一起做ETL。
+        """
+        if table_name == "series":
+            requested = set(ids)
+            rows = self.series_etl(self.expand_ccs_groups(ids), snapshot_time) or []
+            return [row for row in rows if row["_id"] in requested]
+        if table_name == "product":
+            return self.product_etl(ids, snapshot_time) or []
+        raise ValueError(f"Invalid table name: {table_name}")
+
+    def compare_documents(self, table_name, ids, snapshot_time=None):
+        """
+        全字段比较一组ID：ETL结果与MongoDB中未删除且未过期的文档，两边使用同一个快照时间。
+        """
+        snapshot_time = self.resolve_snapshot_time(snapshot_time)
+        expected = self.etl(table_name, ids, snapshot_time)
+        actual = self.fetch_mongo_documents(table_name, ids, snapshot_time)
+        return self.compare_objects_by_id(expected, actual)
+
+    def repair_documents(
+        self,
+        table_name,
+        ids,
+        dry_run=True,
+        batch_size=None,
+        rate_limit=None,
+        progress=None,
+        snapshot_time=None,
+    ):
+        """
+        修复模式：按批对不一致的ID重新执行ETL，用无序 bulk_write 写回 MongoDB。
+        ETL有结果的ID整文档 upsert，没有结果（已删除或已过期）的ID从 MongoDB 删除。
+        dry_run 时只生成报告，不写 MongoDB。
+
+        Returns:
+            dict: checked / upserted / deleted / failed 的数量和报告目录。
+        """
+        collection = self._get_collection(table_name)
+        if batch_size is None:
+            batch_size = self.repair_batch_size
+        if rate_limit is None:
+            rate_limit = self.repair_rate_limit
+        limiter = RateLimiter(rate_limit)
+        snapshot_time = self.resolve_snapshot_time(snapshot_time)
+
+        # 非数字ID（如报告中的字符串/ObjectId _id）无法做ETL，跳过并记录
+        normalized = {}
+        skipped = []
+        for id_ in ids:
+            normalized_id = normalize_id(id_)
+            if normalized_id is None:
+                skipped.append(id_)
+            else:
+                normalized[normalized_id] = None
+        ids = list(normalized)
+
+        if progress is None:
+            progress = ReconcileProgress()
+        progress.min_id, progress.max_id, progress.last_id = 0, len(ids), 0
+
+        counts = {"checked": 0, "upserted": 0, "deleted": 0, "failed": 0, "skipped": len(skipped)}
+        kind = "repair_dry_run" if dry_run else "repair"
+        with self.open_report(table_name, kind) as report:
+            report.summary["snapshot_time"] = snapshot_time
+            report.write_ids("skipped", skipped)
+            for chunk in chunked(ids, batch_size):
+                rows = self.etl(table_name, chunk, snapshot_time)
+                documents = {row["_id"]: to_mongo_document(table_name, row) for row in rows}
+                deleted_ids = [id_ for id_ in chunk if id_ not in documents]
+
+                operations = [
+                    ReplaceOne({"_id": id_}, doc, upsert=True)
+                    for id_, doc in documents.items()
+                ]
+                operations.extend(DeleteOne({"_id": id_}) for id_ in deleted_ids)
+
+                failed = {}
+                if not dry_run and operations:
+                    limiter.acquire(len(operations))
+                    failed = self.bulk_write(
+                        collection, operations, [*documents, *deleted_ids]
+                    )
 
-        product_etl_sql = product_sql.format(
-            product_ids_str, product_ids_str, product_ids_str, product_ids_str
+                for id_ in documents:
+                    if id_ in failed:
+                        report.write("error", id_, operation="upsert", error=failed[id_])
+                    else:
+                        report.write("upsert", id_)
+                for id_ in deleted_ids:
+                    if id_ in failed:
+                        report.write("error", id_, operation="delete", error=failed[id_])
+                    else:
+                        report.write("delete", id_)
+
+                counts["checked"] += len(chunk)
+                counts["upserted"] += sum(1 for id_ in documents if id_ not in failed)
+                counts["deleted"] += sum(1 for id_ in deleted_ids if id_ not in failed)
+                counts["failed"] += len(failed)
+                progress.last_id = counts["checked"]
+                progress.mysql_scanned += len(documents)
+                if not dry_run:
+                    progress.repaired += len(operations) - len(failed)
+            report.summary.update(counts)
+
+        logger.info(
+            f"{table_name} repair{' (dry run)' if dry_run else ''}: {counts}, "
+            f"report written to {report.directory}"
         )
+        return {"dry_run": dry_run, **counts, "report": report.directory}
 
-        product_data = self.mysql_connector.query(product_etl_sql)
-
-        fields_to_split = ["keyword", "guest_tag_names"]
-
-        for row in product_data:
-            for field in fields_to_split:
-                if row[field] and row[field] is not None:
-                    row[field] = [word.strip() for word in set(row[field].split(","))]
+    def bulk_write(self, collection, operations, ids):
+        """
+        无序执行一批写操作，upsert 和按 _id 删除可以安全重试。
+        ids 与 operations 一一对应。
 
-        return product_data
+        Returns:
+            dict: {失败的ID: 错误信息}
+        """
+        try:
+            self._retry(lambda: collection.bulk_write(operations, ordered=False))
+        except BulkWriteError as e:
+            # 无序写入时其余操作照常执行，只记录失败的操作
+            failed = {}
+            for error in e.details.get("writeErrors", []):
+                failed[ids[error["index"]]] = error.get("errmsg")
+            logger.warning(f"{len(failed)} of {len(operations)} writes failed")
+            return failed
+        return {}
 
     def compare_objects_by_id(self, mysql_data, mongo_data):
-        # 创建一个以id为键，对象为值的字典，方便查找
-        mysql_map = {obj["_id"]: obj for obj in mysql_data}
-        mongo_map = {obj["_id"]: obj for obj in mongo_data}
-
-        # 找出所有匹配的id
-        all_ids = set(mysql_map.keys()).union(set(mongo_map.keys()))
-
-        # 比较匹配id的对象
-        differences = {}
-        for id_ in all_ids:
-            obj1 = mysql_map.get(id_)
-            obj2 = mongo_map.get(id_)
-            if obj1 and obj2:
-                # 比较两个对象的其他字段
-                for key in set(obj1.keys()).union(set(obj2.keys())):
-                    if key != "_id":  # 假设 '_id' 是 MongoDB 的默认 ID 字段
-                        val1 = obj1.get(key)
-                        val2 = obj2.get(key)
-                        # 如果字段值是列表，比较元素集合是否相等，忽略顺序
-                        if isinstance(val1, list) and isinstance(val2, list):
-                            if sorted(val1) != sorted(val2):
-                                if id_ not in differences:
-                                    differences[id_] = {}
-                                differences[id_][key] = {"mysql": val1, "mongo": val2}
-                        elif val1 != val2:  # 非列表字段直接比较
-                            if id_ not in differences:
-                                differences[id_] = {}
-                            differences[id_][key] = {"mysql": val1, "mongo": val2}
-            elif obj1 or obj2:
-                # 如果只有一个对象中有这个id，也记录下来
-                if id_ not in differences:
-                    differences[id_] = {}
-                differences[id_]["existence"] = {
-                    "mysql": bool(obj1),
-                    "mongo": bool(obj2),
-                }
-
-        return differences
+        # 按字段列批量比较，返回结构与逐个对象比较时一致
+        return diff_documents(mysql_data, mongo_data)
+
+
+def reconcile_range_worker(config, table_name, lo, hi, schedule_end_time):
+    """
+    子进程入口：用独立的数据库连接对ID区间 [lo, hi) 做归并扫描。
+    """
+    mysql_connector = MySQLConnector(**config["mysql"], pool_size=2)
+    search_engine = SearchEngine(
+        mysql_connector=mysql_connector,
+        mongodb_url=config["mongodb_url"],
+        compare_chunk_size=config["compare_chunk_size"],
+        mongo_batch_size=config["mongo_batch_size"],
+    )
+    try:
+        return search_engine.reconcile_range(
+            table_name, lo, hi, schedule_end_time=schedule_end_time
+        )
+    finally:
+        mysql_connector.close()
+        search_engine.client.close()
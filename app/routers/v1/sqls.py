@@ -3,7 +3,7 @@ WITH series_base AS (
     SELECT *
     FROM series
     WHERE is_deleted=0
-    AND schedule_end_time > UNIX_TIMESTAMP(NOW())
+    AND schedule_end_time > {snapshot_time}
     AND series_id IN ({})
     ),
     
@@ -150,7 +150,7 @@ WITH product_base AS (
     SELECT *
     FROM product
     WHERE is_deleted = 0
-    AND schedule_end_time > UNIX_TIMESTAMP(NOW())
+    AND schedule_end_time > {snapshot_time}
     AND product_id in ({})
     ),
     product_tag_relation AS (
@@ -222,4 +222,175 @@ WHERE pb.product_id in ({})
 product_id_sql="""
 SELECT product_id FROM product WHERE product_id > %s and is_deleted = 0
     AND schedule_end_time > UNIX_TIMESTAMP(NOW()) ORDER BY product_id ASC LIMIT %s
-"""
\ No newline at end of file
+"""
+# 每个ID区间内 (id, last_modified_time) 的行数和摘要，两个取模平方求和，MongoDB 端用同样的公式计算
+range_digest_sql = """
+SELECT
+    FLOOR(({table}_id - %s) / %s) AS bucket,
+    COUNT(*) AS row_count,
+    SUM(MOD(
+        MOD({table}_id * 2654435761 + IFNULL(last_modified_time, 0), 2147483647)
+        * MOD({table}_id * 2654435761 + IFNULL(last_modified_time, 0), 2147483647),
+        2147483647
+    )) AS digest
+FROM {table}
+WHERE is_deleted = 0
+AND schedule_end_time > %s
+AND {table}_id >= %s AND {table}_id < %s
+GROUP BY bucket
+"""
+
+
+# ---- 使用维度缓存时的ETL：只查询基础行和关系ID，名称在内存中拼装 ----
+
+series_base_sql = """
+SELECT
+series_id AS _id,
+series_id,
+name,
+cover_image_uri,
+landscape_image,
+portrait_image,
+product_total,
+released_product_total,
+is_movie,
+source_flag,
+allow_tv,
+allow_telstb,
+description,
+release_time,
+schedule_start_time,
+schedule_end_time,
+is_deleted,
+country_ids,
+area_id,
+language_flag_id,
+last_modified_time,
+poster_logo,
+LOWER(name) AS series_name_lower,
+LOWER(keyword) AS keyword
+FROM series
+WHERE is_deleted=0
+AND schedule_end_time > {snapshot_time}
+AND series_id IN ({})
+"""
+
+series_ccs_relation_sql = """
+SELECT DISTINCT ccs_series_id, series_id
+FROM ccs_ott_series_relation
+WHERE series_id IN ({})
+"""
+
+series_actor_relation_sql = """
+SELECT series_id, tag_actor_id
+FROM series_actor_relation
+WHERE series_id IN ({})
+"""
+
+series_tag_relation_sql = """
+SELECT series_id, tag_id
+FROM series_tag_relation
+WHERE series_id IN ({})
+"""
+
+product_base_sql = """
+SELECT
+    product_id AS _id,
+    product_id,
+    series_id,
+    number,
+    synopsis,
+    description,
+    cover_image_uri,
+    time_duration,
+    schedule_start_time,
+    schedule_end_time,
+    free_time,
+    premium_time,
+    is_free_premium_time,
+    allow_download,
+    LOWER(keyword) AS keyword,
+    is_produced,
+    is_deleted,
+    is_parental_lock_limited,
+    is_parental_lock_compulsory,
+    last_modified_time,
+    area_id,
+    language_flag_id,
+    censorship_ads_id,
+    allow_play_big_screen,
+    play_big_screen_start_time,
+    play_big_screen_end_time,
+    duration_start,
+    source_flag,
+    third_product_id,
+    seo_title,
+    seo_description,
+    chargingcp_id,
+    classification,
+    encryption_string,
+    multiple_image,
+    landscape_image,
+    portrait_image,
+    skip_intro_start_time,
+    skip_intro_end_time,
+    content_advisory,
+    drm,
+    dpr
+FROM product
+WHERE is_deleted = 0
+AND schedule_end_time > {snapshot_time}
+AND product_id IN ({})
+"""
+
+product_tag_relation_sql = """
+SELECT product_id, tag_id
+FROM product_tag_relation
+WHERE product_id IN ({})
+"""
+
+# 维度表：ID -> 小写名称
+dimension_sqls = {
+    "tag_actor": "SELECT tag_actor_id, LOWER(name) FROM tag_actor WHERE is_deleted = 0",
+    "tag": "SELECT tag_id, LOWER(name) FROM tag WHERE is_deleted = 0 AND name != 'undefined'",
+    "tag_guest": "SELECT tag_guest_id, LOWER(name) FROM tag_guest",
+}
+
+# 维度表版本：最大修改时间和行数，任一变化则重新加载
+dimension_version_sql = "SELECT MAX(last_modified_time), COUNT(*) FROM {}"
+
+
+# ---- 增量跟踪：关系表/维度表的变更映射回受影响的 series/product ID ----
+
+series_ids_by_actor_sql = """
+SELECT DISTINCT series_id
+FROM series_actor_relation
+WHERE tag_actor_id IN ({})
+"""
+
+series_ids_by_tag_sql = """
+SELECT DISTINCT series_id
+FROM series_tag_relation
+WHERE tag_id IN ({})
+"""
+
+product_ids_by_guest_tag_sql = """
+SELECT DISTINCT product_id
+FROM product_tag_relation
+WHERE tag_id IN ({})
+"""
+
+# keyword/actor_names/alternative_names 按 ccs_series_id 聚合，同组的 series 一起受影响
+series_ids_by_ccs_group_sql = """
+SELECT DISTINCT other.series_id
+FROM ccs_ott_series_relation changed
+INNER JOIN ccs_ott_series_relation other
+ON changed.ccs_series_id = other.ccs_series_id
+WHERE changed.series_id IN ({})
+"""
+
+series_ids_by_ccs_series_sql = """
+SELECT DISTINCT series_id
+FROM ccs_ott_series_relation
+WHERE ccs_series_id IN ({})
+"""
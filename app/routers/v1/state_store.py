@@ -0,0 +1,40 @@
+import json
+import os
+import threading
+
+
+class StateStore:
+    """
+    A small JSON file used to persist reconciliation state (watermarks etc.) between runs.
+
+    Every `set` rewrites the file atomically, so an interrupted process never
+    leaves a half-written state behind.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            with open(path) as file:
+                self._state = json.load(file)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._state.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._state[key] = value
+            self._flush()
+
+    def delete(self, key):
+        with self._lock:
+            if self._state.pop(key, None) is not None:
+                self._flush()
+
+    def _flush(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self._state, file, default=str)
+        os.replace(tmp_path, self.path)
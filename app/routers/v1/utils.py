@@ -1,7 +1,13 @@
 import datetime
+import itertools
+import queue
+import random
 import re
+import threading
 import time
 
+from loguru import logger
+
 
 def detect_foreign_characters(text):
     """
@@ -77,3 +83,163 @@ def is_chinese(query):
         return True
     else:
         return False
+
+
+def chunked(iterable, size):
+    """
+    Split an iterable into lists of at most `size` items without materializing it.
+
+    Args:
+        iterable (Iterable): The items to be split.
+        size (int): The maximum number of items per chunk.
+
+    Yields:
+        list: The next chunk of items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def chunked_groups(groups, size):
+    """
+    Pack groups of items into chunks of at most `size` items without splitting a group.
+
+    A group larger than `size` becomes a chunk of its own.
+
+    Args:
+        groups (Iterable[list]): The groups of items that must stay together.
+        size (int): The maximum number of items per chunk.
+
+    Yields:
+        list: The next chunk of items.
+    """
+    chunk = []
+    for group in groups:
+        if chunk and len(chunk) + len(group) > size:
+            yield chunk
+            chunk = []
+        chunk.extend(group)
+    if chunk:
+        yield chunk
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(iterable, batch_size=5000, max_batches=4):
+    """
+    Consume an iterable in a background thread and yield its items.
+
+    The producer runs ahead of the consumer by at most `max_batches` batches,
+    so two blocking scans can make progress at the same time while memory
+    stays bounded. Exceptions raised by the producer are re-raised in the
+    consumer.
+
+    Args:
+        iterable (Iterable): The items to be produced in the background.
+        batch_size (int): The number of items handed over per queue operation.
+        max_batches (int): The maximum number of batches buffered ahead.
+
+    Yields:
+        The items of `iterable`, in order.
+    """
+    buffer = queue.Queue(maxsize=max_batches)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for chunk in chunked(iterable, batch_size):
+                if stopped.is_set():
+                    return
+                put(chunk)
+            put(_PREFETCH_DONE)
+        except BaseException as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            chunk = buffer.get()
+            if chunk is _PREFETCH_DONE:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield from chunk
+    finally:
+        stopped.set()
+
+
+def backoff_delay(attempt, base_delay=0.5, max_delay=30.0):
+    """
+    Exponential backoff with full jitter.
+
+    Args:
+        attempt (int): The number of failed attempts so far, starting at 1.
+
+    Returns:
+        float: The number of seconds to wait before the next attempt.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def retry(fn, retry_on, attempts=5, base_delay=0.5, max_delay=30.0):
+    """
+    Call `fn` until it succeeds, retrying `retry_on` errors with exponential backoff.
+
+    Args:
+        fn (callable): Called without arguments.
+        retry_on (tuple): The exception types treated as transient.
+        attempts (int): The maximum number of calls.
+
+    Returns:
+        The result of `fn`. The last error is re-raised once all attempts failed.
+    """
+    for attempt in itertools.count(1):
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt >= attempts:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            logger.warning(
+                f"Transient error (attempt {attempt}/{attempts}), retrying in {delay:.2f}s: {e}"
+            )
+            time.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Limit the average rate of an operation to `rate` units per second.
+
+    `acquire(n)` sleeps until the units acquired before have been paid off, so
+    bursts of at most one call's worth of units pass immediately. A falsy
+    `rate` disables the limit.
+    """
+
+    def __init__(self, rate=None) -> None:
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def acquire(self, units=1):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(self._next, now) + units / self.rate
+        if wait > 0:
+            time.sleep(wait)
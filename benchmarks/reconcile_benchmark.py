@@ -0,0 +1,613 @@
+"""
+Benchmark of the reconciliation stages on synthetic product/series data.
+
+Each dataset size runs in its own (spawned) process against in-memory stand-ins:
+
+- MySQL: a shared-cache in-memory SQLite database behind a `MySQLConnector`
+  subclass, so the real connection pool and SQL paths are exercised.
+- MongoDB: a columnar, NumPy-backed fake collection implementing the `find`
+  subset used by the reconciliation code, with cursor batches counted as
+  round trips.
+
+For every stage it reports wall time, throughput (IDs/sec), peak RSS during the
+stage and the number of MySQL / MongoDB round trips. Results can be saved as a
+baseline and later runs compared against it; a regression makes the script exit
+with status 1.
+
+Usage (from the repository root):
+
+    python -m benchmarks.reconcile_benchmark --sizes 10k,100k,1M,5M
+    python -m benchmarks.reconcile_benchmark --save-baseline benchmarks/baseline.json
+    python -m benchmarks.reconcile_benchmark --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# 导入 app 包时 endpoints 会读取这些环境变量，基准测试不会连接真实数据库
+for name in ("MYSQL_HOST", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_DB"):
+    os.environ.setdefault(name, "benchmark")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:1")
+
+from loguru import logger
+
+from app.routers.v1.mysql_connector import MySQLConnector
+from app.routers.v1.normalization import normalize_document
+from app.routers.v1.search_engine import ReconcileMode, SearchEngine
+from app.routers.v1.state_store import StateStore
+
+STAGES = (
+    "search_data",
+    "fetch_ids",
+    "compare_ids",
+    "compare_fields",
+    "compare_objects_by_id",
+)
+
+# 活跃数据的 schedule_end_time，远大于代码中的截止时间
+FUTURE = 2**31 - 1
+
+# MongoDB 未指定 batch_size 时首批返回 101 个文档，之后每批受 16MB 限制；
+# 只投影 _id/last_modified_time 的小文档按每批 100000 个近似
+MONGO_FIRST_BATCH = 101
+MONGO_DEFAULT_BATCH = 100000
+
+
+class RoundTrips:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.mysql = 0
+        self.mongo = 0
+
+    def add(self, side, count=1):
+        with self._lock:
+            setattr(self, side, getattr(self, side) + count)
+
+    def snapshot(self):
+        with self._lock:
+            return {"mysql": self.mysql, "mongo": self.mongo}
+
+
+class SQLiteCursor:
+    def __init__(self, cursor, round_trips) -> None:
+        self._cursor = cursor
+        self._round_trips = round_trips
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self._round_trips.add("mysql")
+        self._cursor.execute(sql.replace("%s", "?"), params or ())
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, uri, round_trips) -> None:
+        self._connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self._round_trips = round_trips
+
+    def cursor(self, prepared=False):
+        return SQLiteCursor(self._connection.cursor(), self._round_trips)
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False, attempts=1):
+        pass
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+class SQLiteConnector(MySQLConnector):
+    """
+    `MySQLConnector` whose pooled connections point at an in-memory SQLite database.
+    """
+
+    def __init__(self, name, round_trips, pool_size=5) -> None:
+        super().__init__(
+            database=name,
+            host="memory",
+            user="benchmark",
+            password="",
+            pool_size=pool_size,
+        )
+        self.uri = f"file:{name}?mode=memory&cache=shared"
+        self.round_trips = round_trips
+        # 保持一个连接打开，否则共享内存数据库在最后一个连接关闭时被释放
+        self.keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def connect(self):
+        return SQLiteConnection(self.uri, self.round_trips)
+
+
+class FakeCursor:
+    def __init__(self, collection, rows, projection, batch_size) -> None:
+        self._collection = collection
+        self._rows = rows
+        self._projection = projection
+        self._batch_size = batch_size
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        if key != "_id":
+            raise NotImplementedError(f"sort by {key}")
+        if direction == -1:
+            self._rows = self._rows[::-1]
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        rows = self._rows[: self._limit] if self._limit else self._rows
+        if self._batch_size:
+            batches = math.ceil(len(rows) / self._batch_size)
+        elif len(rows) <= MONGO_FIRST_BATCH:
+            batches = 1
+        else:
+            batches = 1 + math.ceil(
+                (len(rows) - MONGO_FIRST_BATCH) / MONGO_DEFAULT_BATCH
+            )
+        self._collection.round_trips.add("mongo", max(batches, 1))
+
+        fields = [
+            field
+            for field in self._collection.columns
+            if self._projection is None or self._projection.get(field)
+        ]
+        columns = [self._collection.columns[field][rows].tolist() for field in fields]
+        for values in zip(*columns):
+            yield dict(zip(fields, values))
+
+
+class FakeCollection:
+    """
+    Columnar in-memory collection supporting the `find` filters used by the reconciliation.
+
+    Documents are kept as NumPy columns sorted by `_id`; only integer `_id`s are supported.
+    """
+
+    def __init__(self, columns, round_trips) -> None:
+        order = np.argsort(columns["_id"], kind="stable")
+        self.columns = {field: values[order] for field, values in columns.items()}
+        self.round_trips = round_trips
+
+    def _match_ids(self, condition):
+        # _id 有序，区间和 $in 都用二分查找，不扫描整列
+        ids = self.columns["_id"]
+        if not isinstance(condition, dict):
+            condition = {"$in": [condition]}
+        start, stop = 0, len(ids)
+        selected = None
+        for operator, operand in condition.items():
+            if operator == "$gt":
+                start = max(start, np.searchsorted(ids, operand, side="right"))
+            elif operator == "$gte":
+                start = max(start, np.searchsorted(ids, operand, side="left"))
+            elif operator == "$lt":
+                stop = min(stop, np.searchsorted(ids, operand, side="left"))
+            elif operator == "$in":
+                wanted = np.unique(np.fromiter(operand, dtype=np.int64))
+                positions = np.searchsorted(ids, wanted)
+                positions = positions[positions < len(ids)]
+                selected = positions[ids[positions] == wanted[: len(positions)]]
+            elif operator == "$type" and operand == "number":
+                pass
+            else:
+                raise NotImplementedError(f"_id: {operator}")
+        if selected is None:
+            return np.arange(start, max(start, stop))
+        return selected[(selected >= start) & (selected < stop)]
+
+    def _match(self, query):
+        query = dict(query or {})
+        rows = self._match_ids(query.pop("_id", {}))
+        for field, condition in query.items():
+            values = self.columns[field][rows]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            mask = np.ones(len(rows), dtype=bool)
+            for operator, operand in condition.items():
+                if operator == "$eq":
+                    mask &= values == operand
+                elif operator == "$gt":
+                    mask &= values > operand
+                elif operator == "$gte":
+                    mask &= values >= operand
+                elif operator == "$lt":
+                    mask &= values < operand
+                else:
+                    raise NotImplementedError(f"{field}: {operator}")
+            rows = rows[mask]
+        return rows
+
+    def find(self, filter=None, projection=None, batch_size=0, **kwargs):
+        return FakeCursor(self, self._match(filter), projection, batch_size)
+
+
+class RssSampler:
+    """
+    Samples the resident set size of this process while a stage runs.
+    """
+
+    def __init__(self, interval=0.01) -> None:
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # 非 Linux 平台只能取进程启动以来的峰值
+            scale = 1 if sys.platform == "darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(value[-1:], 1)
+    if scale != 1:
+        value = value[:-1]
+    return int(float(value) * scale)
+
+
+def generate_dataset(rows, drift, seed):
+    """
+    Build the MySQL rows and MongoDB documents of one table with controlled drift.
+
+    A `drift` fraction of the rows is each: missing in MongoDB, extra in MongoDB,
+    given a different `last_modified_time` in MongoDB, and soft-deleted on both sides.
+
+    Returns:
+        tuple: (mysql_columns, mongo_columns), dicts of NumPy arrays.
+    """
+    rng = np.random.default_rng(seed)
+    drifted = int(rows * drift)
+
+    # 递增但不连续的ID
+    ids = np.cumsum(rng.integers(1, 4, rows, dtype=np.int64))
+    last_modified = rng.integers(1_600_000_000, 1_700_000_000, rows, dtype=np.int64)
+    is_deleted = np.zeros(rows, dtype=np.int64)
+    schedule_end_time = np.full(rows, FUTURE, dtype=np.int64)
+
+    picked = rng.permutation(rows)[: 3 * drifted]
+    missing, changed, deleted = np.split(picked, [drifted, 2 * drifted])
+    is_deleted[deleted] = 1
+
+    mysql_columns = {
+        "_id": ids,
+        "is_deleted": is_deleted,
+        "schedule_end_time": schedule_end_time,
+        "last_modified_time": last_modified,
+    }
+
+    keep = np.ones(rows, dtype=bool)
+    keep[missing] = False
+    mongo_last_modified = last_modified.copy()
+    mongo_last_modified[changed] += 1
+    extra = ids[-1] + 1 + np.arange(drifted, dtype=np.int64)
+    mongo_columns = {
+        "_id": np.concatenate([ids[keep], extra]),
+        "is_deleted": np.concatenate([is_deleted[keep], np.zeros(drifted, np.int64)]),
+        "schedule_end_time": np.concatenate(
+            [schedule_end_time[keep], np.full(drifted, FUTURE, np.int64)]
+        ),
+        "last_modified_time": np.concatenate(
+            [mongo_last_modified[keep], np.full(drifted, 1_600_000_000, np.int64)]
+        ),
+    }
+    return mysql_columns, mongo_columns
+
+
+def load_mysql(connector, table_name, columns, batch_size=100000):
+    connection = connector.keeper
+    connection.execute(
+        f"CREATE TABLE {table_name} ({table_name}_id INTEGER PRIMARY KEY, is_deleted INTEGER, schedule_end_time INTEGER, last_modified_time INTEGER)"
+    )
+    for start in range(0, len(columns["_id"]), batch_size):
+        stop = start + batch_size
+        connection.executemany(
+            f"INSERT INTO {table_name} VALUES (?, ?, ?, ?)",
+            zip(
+                columns["_id"][start:stop].tolist(),
+                columns["is_deleted"][start:stop].tolist(),
+                columns["schedule_end_time"][start:stop].tolist(),
+                columns["last_modified_time"][start:stop].tolist(),
+            ),
+        )
+    connection.commit()
+
+
+def generate_documents(rows, drift, seed):
+    """
+    Build series-like ETL rows and MongoDB documents for `compare_objects_by_id`.
+    """
+    rng = np.random.default_rng(seed)
+    words = [f"word{i}" for i in range(200)]
+    mysql_data, mongo_data = [], []
+    changed = set(rng.permutation(rows)[: int(rows * drift)].tolist())
+    for i in range(rows):
+        names = [words[j] for j in rng.integers(0, len(words), 5)]
+        row = {
+            "_id": i + 1,
+            "name": f"series {i}",
+            "is_deleted": 0,
+            "last_modified_time": 1_600_000_000 + i,
+            "keyword": ",".join(names),
+            "tag_names": ",".join(reversed(names)),
+        }
+        doc = dict(row, keyword=list(reversed(names)), tag_names=names)
+        if i in changed:
+            doc["name"] = f"series {i} (changed)"
+        mysql_data.append(normalize_document("series", row))
+        mongo_data.append(normalize_document("series", doc))
+    return mysql_data, mongo_data
+
+
+def run_size(rows, table_name, drift, document_rows, seed, log_level="ERROR"):
+    """
+    Load one dataset size and time every stage. Runs in a child process.
+
+    Reports and state are written to a temporary directory that is removed
+    afterwards.
+
+    Returns:
+        dict: {stage: {"seconds", "items", "ids_per_sec", "peak_rss_mb", "mysql_round_trips", "mongo_round_trips"}}
+    """
+    logger.remove()
+    logger.add(sys.stderr, level=log_level)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="reconcile_benchmark_") as workdir:
+        os.chdir(workdir)
+        try:
+            return measure_stages(workdir, rows, table_name, drift, document_rows, seed)
+        finally:
+            os.chdir(cwd)
+
+
+def measure_stages(workdir, rows, table_name, drift, document_rows, seed):
+    round_trips = RoundTrips()
+    connector = SQLiteConnector(f"benchmark_{rows}_{os.getpid()}", round_trips)
+    mysql_columns, mongo_columns = generate_dataset(rows, drift, seed)
+    load_mysql(connector, table_name, mysql_columns)
+
+    engine = SearchEngine(
+        mysql_connector=connector,
+        mongodb_url="mongodb://localhost:1",
+        state_store=StateStore(os.path.join(workdir, "validation_state.json")),
+    )
+    engine.client.close()
+    setattr(
+        engine,
+        f"{table_name}_collection",
+        FakeCollection(mongo_columns, round_trips),
+    )
+    del mysql_columns, mongo_columns
+
+    state = {}
+
+    def fetch_ids():
+        state["mysql_ids"] = engine.fetch_mysql_data(table_name)
+        state["mongo_ids"] = engine.fetch_mongo_data(table_name)
+        return len(state["mysql_ids"]) + len(state["mongo_ids"])
+
+    def search_data():
+        asyncio.run(engine.search_data(table_name, ReconcileMode.full))
+        return rows
+
+    def compare_ids():
+        engine.compare_ids(table_name, state["mysql_ids"], state["mongo_ids"])
+        return len(state["mysql_ids"]) + len(state["mongo_ids"])
+
+    def compare_fields():
+        common = state["mysql_ids"] & state["mongo_ids"]
+        engine.compare_fields(table_name, common)
+        return len(common)
+
+    def compare_objects_by_id():
+        mysql_data, mongo_data = state.pop("documents")
+        engine.compare_objects_by_id(mysql_data, mongo_data)
+        return len(mysql_data)
+
+    stages = {
+        "search_data": search_data,
+        "fetch_ids": fetch_ids,
+        "compare_ids": compare_ids,
+        "compare_fields": compare_fields,
+        "compare_objects_by_id": compare_objects_by_id,
+    }
+
+    results = {}
+    for stage in STAGES:
+        if stage == "compare_objects_by_id":
+            # 全字段比较只用 document_rows 条文档，文档在计时之前生成
+            state["documents"] = generate_documents(
+                min(rows, document_rows), drift, seed
+            )
+        before = round_trips.snapshot()
+        with RssSampler() as sampler:
+            started = time.perf_counter()
+            items = stages[stage]()
+            seconds = time.perf_counter() - started
+        after = round_trips.snapshot()
+        results[stage] = {
+            "seconds": round(seconds, 4),
+            "items": items,
+            "ids_per_sec": round(items / seconds) if seconds else None,
+            "peak_rss_mb": round(sampler.peak / 2**20, 1),
+            "mysql_round_trips": after["mysql"] - before["mysql"],
+            "mongo_round_trips": after["mongo"] - before["mongo"],
+        }
+
+    connector.close()
+    connector.keeper.close()
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Returns:
+        list: Human readable regressions, empty when the run is within tolerance.
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(size, {}).get(stage)
+            if previous is None:
+                continue
+            label = f"{size} rows / {stage}"
+            if (
+                previous["ids_per_sec"]
+                and current["ids_per_sec"] is not None
+                and current["ids_per_sec"] < previous["ids_per_sec"] * (1 - tolerance)
+            ):
+                regressions.append(
+                    f"{label}: throughput {current['ids_per_sec']} < {previous['ids_per_sec']} IDs/sec"
+                )
+            if current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(
+                    f"{label}: peak RSS {current['peak_rss_mb']} > {previous['peak_rss_mb']} MB"
+                )
+            # 往返次数是确定的，任何增加都算回退
+            for key in ("mysql_round_trips", "mongo_round_trips"):
+                if current[key] > previous[key]:
+                    regressions.append(f"{label}: {key} {current[key]} > {previous[key]}")
+    return regressions
+
+
+def print_results(results):
+    header = f"{'rows':>9} {'stage':<22} {'seconds':>9} {'IDs/sec':>11} {'peak RSS MB':>12} {'MySQL RT':>9} {'Mongo RT':>9}"
+    print(header)
+    print("-" * len(header))
+    for size, stages in results.items():
+        for stage, result in stages.items():
+            print(
+                f"{size:>9} {stage:<22} {result['seconds']:>9.3f} {result['ids_per_sec'] or 0:>11} "
+                f"{result['peak_rss_mb']:>12} {result['mysql_round_trips']:>9} {result['mongo_round_trips']:>9}"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes", default="10k,100k", help="comma separated row counts, e.g. 10k,100k,1M,5M"
+    )
+    parser.add_argument("--table", default="product", choices=("product", "series"))
+    parser.add_argument(
+        "--drift", type=float, default=0.001, help="fraction of rows per kind of drift"
+    )
+    parser.add_argument(
+        "--document-rows",
+        type=int,
+        default=100000,
+        help="maximum number of documents used by compare_objects_by_id",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--save-baseline", help="save the results as a baseline")
+    parser.add_argument("--baseline", help="compare the results with a saved baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed relative throughput / peak RSS regression against the baseline",
+    )
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+
+    results = {}
+    # 每个数据规模在独立进程中运行，峰值内存互不影响
+    context = multiprocessing.get_context("spawn")
+    for size in (parse_size(value) for value in args.sizes.split(",")):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[str(size)] = executor.submit(
+                run_size,
+                size,
+                args.table,
+                args.drift,
+                args.document_rows,
+                args.seed,
+                args.log_level,
+            ).result()
+
+    print_results(results)
+
+    report = {
+        "table": args.table,
+        "drift": args.drift,
+        "document_rows": args.document_rows,
+        "seed": args.seed,
+        "results": results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare_with_baseline(
+            results, baseline["results"], args.tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,8 @@ The module also defines a date format string and calculates the start time of th
 The health check endpoint (`/api/health_check`) returns a dictionary containing a message with the server's uptime
 and the start time in Hong Kong time.
 
+The metrics endpoint (`/api/metrics`) exposes the validation metrics in the Prometheus text format.
+
 If the module is run directly (`__main__`), it starts the uvicorn server on `0.0.0.0:8080`.
 """
 
@@ -31,7 +33,7 @@ from pymongo import MongoClient
 import uvicorn
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 from loguru import logger
 
 
@@ -121,5 +123,17 @@ async def health_check():
     )
 
 
+@app.get(f"{PREFIX}/metrics")
+async def metrics():
+    """
+    Endpoint exposing stage latencies, database round trips, rows transferred,
+    MySQL pool wait times and cache statistics in the Prometheus text format.
+    """
+    return PlainTextResponse(
+        v1.metrics.REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8080)
@@ -0,0 +1,155 @@
+"""
+Shared fixtures: a `SearchEngine` whose MySQL side is an in-memory SQLite
+database behind the real `MySQLConnector` pool, and whose MongoDB side is
+mongomock.
+"""
+
+import itertools
+import os
+import sqlite3
+
+import pytest
+
+# app.routers.v1 imports the endpoints module, which reads these at import time
+for name in ("MYSQL_HOST", "MYSQL_USER", "MYSQL_PASSWORD", "MYSQL_DB"):
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+
+import mongomock
+
+from app.routers.v1 import search_engine as search_engine_module
+from app.routers.v1.mysql_connector import MySQLConnector
+from app.routers.v1.state_store import StateStore
+
+# 在线数据的 schedule_end_time
+FUTURE = 2**31 - 1
+
+_databases = itertools.count()
+
+
+class SQLiteCursor:
+    def __init__(self, cursor) -> None:
+        self._cursor = cursor
+        self.rowcount = -1
+
+    def execute(self, sql, params=None):
+        self._cursor.execute(sql.replace("%s", "?"), params or ())
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, size):
+        return self._cursor.fetchmany(size)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, uri) -> None:
+        self._connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def cursor(self, prepared=False):
+        return SQLiteCursor(self._connection.cursor())
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False, attempts=1):
+        pass
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+class SQLiteConnector(MySQLConnector):
+    """
+    `MySQLConnector` whose pooled connections share one in-memory SQLite database.
+    """
+
+    def __init__(self, pool_size=2) -> None:
+        super().__init__(
+            database="test", host="memory", user="test", password="", pool_size=pool_size
+        )
+        self.uri = f"file:test_{next(_databases)}?mode=memory&cache=shared"
+        # 保持一个连接打开，否则共享内存数据库在最后一个连接关闭时被释放
+        self.db = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+    def connect(self):
+        return SQLiteConnection(self.uri)
+
+    def load(self, sql, rows=()):
+        """
+        Run `sql` once, or once per row of `rows`, and commit.
+        """
+        if rows:
+            self.db.executemany(sql, rows)
+        else:
+            self.db.execute(sql)
+        self.db.commit()
+
+
+@pytest.fixture
+def mysql_connector():
+    connector = SQLiteConnector()
+    for table_name in ("product", "series"):
+        connector.load(
+            f"CREATE TABLE {table_name} ({table_name}_id INTEGER PRIMARY KEY, "
+            "is_deleted INTEGER, schedule_end_time INTEGER, last_modified_time INTEGER)"
+        )
+    connector.load("CREATE TABLE ccs_ott_series_relation (ccs_series_id INTEGER, series_id INTEGER)")
+    connector.load("CREATE TABLE series_actor_relation (series_id INTEGER, tag_actor_id INTEGER)")
+    yield connector
+    connector.close()
+    connector.db.close()
+
+
+@pytest.fixture
+def engine(mysql_connector, tmp_path, monkeypatch):
+    monkeypatch.setattr(search_engine_module, "MongoClient", mongomock.MongoClient)
+    engine = search_engine_module.SearchEngine(
+        mysql_connector=mysql_connector,
+        mongodb_url="mongodb://localhost:27017",
+        state_store=StateStore(str(tmp_path / "validation_state.json")),
+        report_dir=str(tmp_path / "reports"),
+        compare_chunk_size=2,
+        etl_chunk_size=2,
+        retry_base_delay=0,
+    )
+    yield engine
+    engine.client.close()
+
+
+@pytest.fixture
+def add_rows(engine):
+    """
+    Insert `(id, last_modified_time)` rows live into MySQL, and `mongo_rows`
+    (the same rows by default) into MongoDB.
+    """
+
+    def add(table_name, rows, mongo_rows=None):
+        engine.mysql_connector.load(
+            f"INSERT INTO {table_name} VALUES (?, 0, {FUTURE}, ?)", rows
+        )
+        if mongo_rows is None:
+            mongo_rows = rows
+        documents = [
+            {
+                "_id": id,
+                "is_deleted": 0,
+                "schedule_end_time": FUTURE,
+                "last_modified_time": modified,
+            }
+            for id, modified in mongo_rows
+        ]
+        if documents:
+            engine._get_collection(table_name).insert_many(documents)
+
+    return add
@@ -0,0 +1,144 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from app.routers.v1.change_stream_validator import ChangeStreamValidator
+
+
+class FakeChangeStream:
+    """
+    The `watch` cursor subset used by the validator: the queued changes are
+    returned one by one, then the stream closes.
+    """
+
+    def __init__(self, changes) -> None:
+        self._changes = list(changes)
+        self.resume_token = None
+        self.alive = True
+
+    def try_next(self):
+        if not self._changes:
+            self.alive = False
+            return None
+        change = self._changes.pop(0)
+        self.resume_token = change["_id"]
+        return change
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeCollection:
+    def __init__(self, ids) -> None:
+        self.ids = ids
+        self.resume_after = []
+
+    def watch(self, pipeline, resume_after=None, max_await_time_ms=None):
+        self.resume_after.append(resume_after)
+        return FakeChangeStream(
+            {"_id": {"_data": str(index)}, "documentKey": {"_id": id}}
+            for index, id in enumerate(self.ids)
+        )
+
+
+@pytest.fixture
+def validator(engine):
+    validator = ChangeStreamValidator(engine, "product", batch_size=10, max_wait=0)
+    yield validator
+    validator.stop()
+
+
+def read_records(report):
+    report.flush()
+    with open(report.path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_non_numeric_ids_are_not_sent_to_the_etl(engine, validator, monkeypatch):
+    compared = []
+
+    def compare_documents(table_name, ids, snapshot_time=None):
+        compared.append(ids)
+        return {}
+
+    monkeypatch.setattr(engine, "compare_documents", compare_documents)
+    object_id = ObjectId()
+
+    with engine.open_report("product", "change_stream") as report:
+        differences = validator.validate([1, object_id, "abc", 2.0], report)
+
+    assert compared == [[1, 2]]
+    assert differences == {
+        object_id: {"existence": {"mysql": False, "mongo": True}},
+        "abc": {"existence": {"mysql": False, "mongo": True}},
+    }
+
+
+def test_mismatches_are_compared_twice(engine, validator, monkeypatch):
+    compared = []
+    differ = {"title": {"mysql": "a", "mongo": "b"}}
+    # 第二次比较时 2 已经一致，只剩 1
+    results = iter([{1: differ, 2: differ}, {1: differ}])
+
+    def compare_documents(table_name, ids, snapshot_time=None):
+        compared.append(list(ids))
+        return next(results)
+
+    monkeypatch.setattr(engine, "compare_documents", compare_documents)
+
+    with engine.open_report("product", "change_stream") as report:
+        validator.validate([1, 2, 3], report)
+        records = read_records(report)
+
+    assert compared == [[1, 2, 3], [1, 2]]
+    assert [record["id"] for record in records] == [1]
+    assert validator.stats["mismatched"] == 1
+
+
+def test_poison_batch_is_skipped_and_the_token_advances(engine, validator, monkeypatch):
+    def compare_documents(table_name, ids, snapshot_time=None):
+        raise TypeError("cannot compare")
+
+    monkeypatch.setattr(engine, "compare_documents", compare_documents)
+    collection = FakeCollection([7])
+    validator.collection = collection
+
+    with engine.open_report("product", "change_stream") as report:
+        # 前几次失败时重新抛出，调用方从同一个断点重新打开
+        for _ in range(validator.max_batch_failures - 1):
+            with pytest.raises(TypeError):
+                list(validator.tail(report))
+            assert engine.state_store.get(validator.state_key) is None
+
+        list(validator.tail(report))
+        records = read_records(report)
+
+    assert collection.resume_after == [None] * validator.max_batch_failures
+    assert records == [{"type": "error", "id": 7, "error": "cannot compare"}]
+    assert validator.stats["errors"] == 1
+    assert engine.state_store.get(validator.state_key) == {"_data": "0"}
+
+
+def test_a_successful_batch_resets_the_failure_count(engine, validator, monkeypatch):
+    failures = iter([True, True, False, True, True])
+
+    def compare_documents(table_name, ids, snapshot_time=None):
+        if next(failures):
+            raise TypeError("cannot compare")
+        return {}
+
+    monkeypatch.setattr(engine, "compare_documents", compare_documents)
+
+    with engine.open_report("product", "change_stream") as report:
+        for fails in (True, True, False, True, True):
+            if fails:
+                with pytest.raises(TypeError):
+                    validator.validate_batch([1], report)
+            else:
+                validator.validate_batch([1], report)
+
+    assert validator.stats["errors"] == 0
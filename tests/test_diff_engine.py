@@ -0,0 +1,51 @@
+from decimal import Decimal
+
+from bson.decimal128 import Decimal128
+
+from app.routers.v1.diff_engine import diff_documents
+from app.routers.v1.normalization import normalize_document
+
+
+def test_identical_documents_have_no_differences():
+    mysql_data = [{"_id": 1, "title": "a", "keyword": "x,y"}]
+    mongo_data = [{"_id": 1, "title": "a", "keyword": "x,y"}]
+
+    assert diff_documents(mysql_data, mongo_data) == {}
+
+
+def test_ids_on_one_side_are_existence_differences():
+    differences = diff_documents([{"_id": 1}, {"_id": 2}], [{"_id": 2}, {"_id": 3}])
+
+    assert differences == {
+        1: {"existence": {"mysql": True, "mongo": False}},
+        3: {"existence": {"mysql": False, "mongo": True}},
+    }
+
+
+def test_differing_fields_are_reported_for_display():
+    mysql_doc = normalize_document("product", {"_id": 1, "title": "a", "keyword": "x, y"})
+    mongo_doc = normalize_document("product", {"_id": 1, "title": "b", "keyword": ["y", "z"]})
+
+    assert diff_documents([mysql_doc], [mongo_doc]) == {
+        1: {
+            "title": {"mysql": "a", "mongo": "b"},
+            "keyword": {"mysql": ["x", "y"], "mongo": ["y", "z"]},
+        }
+    }
+
+
+def test_list_order_and_decimal_encoding_are_ignored():
+    mysql_doc = normalize_document(
+        "product", {"_id": 1, "keyword": "x,y", "price": Decimal("1.50"), "tags": ["a", "b"]}
+    )
+    mongo_doc = normalize_document(
+        "product", {"_id": 1, "keyword": ["y", "x"], "price": Decimal128("1.50"), "tags": ["b", "a"]}
+    )
+
+    assert diff_documents([mysql_doc], [mongo_doc]) == {}
+
+
+def test_missing_field_differs_from_a_value():
+    differences = diff_documents([{"_id": 1, "title": "a"}], [{"_id": 1}])
+
+    assert differences == {1: {"title": {"mysql": "a", "mongo": None}}}
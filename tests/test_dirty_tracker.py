@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from app.routers.v1.dirty_tracker import DirtyIdTracker, ReplaySource
+
+
+@pytest.fixture
+def replay(tmp_path):
+    """
+    Write row events to a JSONL replay file and return a tracker reading it.
+    """
+
+    def tracker(engine, *events):
+        path = tmp_path / "binlog.jsonl"
+        with open(path, "w") as file:
+            for table_name, rows in events:
+                file.write(json.dumps({"table": table_name, "rows": rows}) + "\n")
+        return DirtyIdTracker(engine, ReplaySource(str(path)))
+
+    return tracker
+
+
+def test_document_and_relation_rows_mark_ids_dirty(engine, replay):
+    tracker = replay(
+        engine,
+        ("product", [{"product_id": 1}]),
+        ("product_tag_relation", [{"product_id": 2, "tag_id": 9}]),
+        # 关系行改变了所属ID：新旧两行都受影响
+        ("series_tag_relation", [{"series_id": 3, "tag_id": 9}, {"series_id": 4, "tag_id": 9}]),
+        ("unrelated", [{"series_id": 5}]),
+    )
+
+    tracker.run()
+
+    assert tracker.drain("product", 10) == [1, 2]
+    assert sorted(tracker.drain("series", 10)) == [3, 4]
+    assert tracker.stats["events"] == 4
+
+
+def test_dimension_rows_resolve_to_documents(engine, replay):
+    engine.mysql_connector.load(
+        "INSERT INTO series_actor_relation VALUES (?, ?)", [(1, 7), (2, 7), (3, 8)]
+    )
+    tracker = replay(engine, ("tag_actor", [{"tag_actor_id": 7}]))
+
+    tracker.run()
+
+    assert tracker.pending()["tag_actor"] == 1
+    assert sorted(tracker.drain("series", 10)) == [1, 2]
+    assert tracker.pending()["tag_actor"] == 0
+
+
+def test_dirty_series_expand_to_their_ccs_group(engine, replay):
+    engine.mysql_connector.load(
+        "INSERT INTO ccs_ott_series_relation VALUES (?, ?)", [(100, 1), (100, 2), (200, 3)]
+    )
+    tracker = replay(engine, ("series", [{"series_id": 1}]))
+
+    tracker.run()
+
+    assert sorted(tracker.drain("series", 10)) == [1, 2]
+
+
+def test_removed_ccs_relation_marks_the_old_group_dirty(engine, replay):
+    # series 1 已经从 ccs 组 100 移到组 200，关系表中只剩新的一行
+    engine.mysql_connector.load(
+        "INSERT INTO ccs_ott_series_relation VALUES (?, ?)",
+        [(100, 2), (100, 3), (200, 1), (200, 4), (300, 5)],
+    )
+    tracker = replay(
+        engine,
+        (
+            "ccs_ott_series_relation",
+            [{"ccs_series_id": 100, "series_id": 1}, {"ccs_series_id": 200, "series_id": 1}],
+        ),
+    )
+
+    tracker.run()
+
+    assert sorted(tracker.drain("series", 10)) == [1, 2, 3, 4]
+
+
+def test_position_is_saved_once_everything_is_validated(engine, replay):
+    tracker = replay(engine, ("product", [{"product_id": 1}, {"product_id": 2}]))
+    tracker.run()
+
+    assert tracker.drain("product", 1) == [1]
+    tracker.checkpoint()
+    assert engine.state_store.get("binlog_position") is None
+
+    assert tracker.drain("product", 1) == [2]
+    tracker.checkpoint()
+    assert engine.state_store.get("binlog_position") == {"line": 1}
+
+
+def test_validate_reports_mismatches_and_requeues_on_failure(engine, replay, monkeypatch):
+    tracker = replay(engine, ("product", [{"product_id": 1}, {"product_id": 2}]))
+    tracker.run()
+
+    def failing(table_name, ids, snapshot_time=None):
+        raise RuntimeError("MySQL is down")
+
+    monkeypatch.setattr(engine, "compare_documents", failing)
+    with pytest.raises(RuntimeError):
+        tracker.validate("product")
+    assert tracker.pending()["product"] == 2
+    assert engine.state_store.get("binlog_position") is None
+
+    def compare_documents(table_name, ids, snapshot_time=None):
+        return {2: {"title": {"mysql": "a", "mongo": "b"}}}
+
+    monkeypatch.setattr(engine, "compare_documents", compare_documents)
+    result = tracker.validate("product")
+
+    assert {key: result[key] for key in ("checked", "mismatched")} == {"checked": 2, "mismatched": 1}
+    with open(f"{result['report']}/mismatches.jsonl") as file:
+        assert [json.loads(line)["id"] for line in file] == [2]
+    assert tracker.pending()["product"] == 0
+    assert engine.state_store.get("binlog_position") == {"line": 1}
+
+
+def test_replay_resumes_after_the_saved_position(engine, replay):
+    engine.state_store.set("binlog_position", {"line": 1})
+    tracker = replay(
+        engine,
+        ("product", [{"product_id": 1}]),
+        ("product", [{"product_id": 2}]),
+    )
+
+    tracker.run()
+
+    assert tracker.drain("product", 10) == [2]
@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+from bson import ObjectId
+
+from app.routers.v1.report_writer import MismatchReport, read_report_ids
+
+
+def read_manifest(report):
+    with open(os.path.join(report.directory, MismatchReport.MANIFEST)) as file:
+        return json.load(file)
+
+
+def test_records_and_manifest(tmp_path):
+    object_id = ObjectId()
+    with MismatchReport(str(tmp_path), "product", "full") as report:
+        report.summary["mysql_count"] = 3
+        report.write_ids("missing_in_mongo", [1, 2])
+        report.write_ids("missing_in_mysql", [object_id])
+        report.write("document_mismatch", 3, differences={"title": {"mysql": "a", "mongo": "b"}})
+
+    with open(report.path) as file:
+        records = [json.loads(line) for line in file]
+    assert records == [
+        {"type": "missing_in_mongo", "id": 1},
+        {"type": "missing_in_mongo", "id": 2},
+        {"type": "missing_in_mysql", "id": str(object_id)},
+        {"type": "document_mismatch", "id": 3, "differences": {"title": {"mysql": "a", "mongo": "b"}}},
+    ]
+    manifest = read_manifest(report)
+    assert manifest["status"] == "succeeded"
+    assert manifest["kind"] == "full"
+    assert manifest["counts"] == {"missing_in_mongo": 2, "missing_in_mysql": 1, "document_mismatch": 1}
+    assert manifest["summary"] == {"mysql_count": 3}
+
+
+def test_failed_run_is_marked_in_the_manifest(tmp_path):
+    with pytest.raises(RuntimeError):
+        with MismatchReport(str(tmp_path), "series", "dirty") as report:
+            report.write("document_mismatch", 1)
+            raise RuntimeError("interrupted")
+
+    assert read_manifest(report)["status"] == "failed"
+
+
+def test_read_report_ids_filters_and_dedupes(tmp_path):
+    with MismatchReport(str(tmp_path), "product", "full") as report:
+        report.write_ids("missing_in_mongo", [3, 1])
+        report.write_ids("last_modified_mismatch", [2, 3])
+
+    assert read_report_ids(str(tmp_path), "product", report.run_id) == [3, 1, 2]
+    assert read_report_ids(str(tmp_path), "product", report.run_id, ["last_modified_mismatch"]) == [2, 3]
+
+
+def test_read_report_ids_rejects_paths(tmp_path):
+    with pytest.raises(ValueError):
+        read_report_ids(str(tmp_path), "product", "../product")
+    with pytest.raises(FileNotFoundError):
+        read_report_ids(str(tmp_path), "product", "missing")
@@ -0,0 +1,105 @@
+import json
+import os
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.routers.v1.id_set import id_sort_key
+from app.routers.v1.job_manager import ReconcileProgress
+from app.routers.v1.report_writer import read_report_ids
+from app.routers.v1.search_engine import ReconcileMode
+
+
+def only_run_id(engine, table_name):
+    (run_id,) = os.listdir(os.path.join(engine.report_dir, table_name))
+    return run_id
+
+
+def test_reconcile_ids_merges_both_sides(engine, add_rows):
+    add_rows("product", [(1, 1), (2, 2), (3, 3), (5, 5)], mongo_rows=[(2, 2), (3.0, 3), (4, 4), (5, 5)])
+    engine.product_collection.insert_one(
+        {"_id": "abc", "is_deleted": 0, "schedule_end_time": 2**31 - 1}
+    )
+
+    sides = {"both": [], "mysql": [], "mongo": []}
+    for side, id in engine.reconcile_ids("product", batch_size=2):
+        sides[side].append(id)
+
+    assert sides == {"both": [2, 3, 5], "mysql": [1], "mongo": [4, "abc"]}
+
+
+def test_reconcile_ids_limits_the_range(engine, add_rows):
+    add_rows("product", [(id, id) for id in range(1, 10)])
+
+    ids = [id for _, id in engine.reconcile_ids("product", lo=3, hi=6)]
+
+    assert ids == [3, 4, 5]
+
+
+def test_recheck_mismatches_drops_resolved_ids(engine, add_rows):
+    add_rows("product", [(1, 1), (2, 2), (3, 3)], mongo_rows=[(1, 1), (2, 20), (4, 4)])
+    object_id = ObjectId()
+    result = {
+        "mysql_count": 3,
+        "mongo_count": 4,
+        # 1 已经写入 MongoDB，重新查询后不再是缺失
+        "missing_in_mongo": [1, 3],
+        "missing_in_mysql": [4, object_id],
+        "last_modified_mismatches": [2],
+    }
+
+    confirmed = engine.recheck_mismatches("product", result, schedule_end_time=0)
+
+    assert confirmed["missing_in_mongo"] == [3]
+    assert confirmed["missing_in_mysql"] == [object_id, 4]
+    assert confirmed["last_modified_mismatches"] == [2]
+    assert confirmed["resolved_on_recheck"] == 1
+    assert confirmed["mysql_count"] == 3
+
+
+def test_reconcile_full_writes_the_report(engine, add_rows):
+    add_rows("product", [(1, 1), (2, 2), (3, 3)], mongo_rows=[(2, 20), (3, 3), (4, 4)])
+
+    ids_match = engine.reconcile_table("product", mode=ReconcileMode.full)
+
+    assert not ids_match
+    run_id = only_run_id(engine, "product")
+    report = lambda type: read_report_ids(engine.report_dir, "product", run_id, [type])
+    assert report("missing_in_mongo") == [1]
+    assert report("missing_in_mysql") == [4]
+    assert report("last_modified_mismatch") == [2]
+    assert engine.state_store.get("product.full_scan_checkpoint") is None
+
+
+def test_incremental_progress_is_json_serializable(engine, add_rows):
+    add_rows("product", [(1, 1000), (2, 5000), (3, 6000)], mongo_rows=[(1, 1000), (2, 5000)])
+    progress = ReconcileProgress()
+
+    ids_match, watermark = engine.reconcile_changes("product", 4000, progress)
+
+    assert not ids_match
+    assert watermark == 6000
+    assert (progress.min_id, progress.max_id) == (2, 3)
+    assert type(progress.min_id) is int
+    json.dumps(jsonable_encoder(progress.to_dict()))
+
+
+def test_checksum_mode_reports_non_numeric_ids(engine, add_rows):
+    add_rows("product", [(id, id) for id in range(1, 40)], mongo_rows=[(id, id) for id in range(2, 40)])
+    engine.product_collection.insert_one(
+        {"_id": "abc", "is_deleted": 0, "schedule_end_time": 2**31 - 1}
+    )
+    progress = ReconcileProgress()
+
+    ids_match = engine.reconcile_checksums("product", progress, leaf_size=4, fanout=4)
+
+    assert not ids_match
+    run_id = only_run_id(engine, "product")
+    assert read_report_ids(engine.report_dir, "product", run_id, ["missing_in_mongo"]) == [1]
+    assert read_report_ids(engine.report_dir, "product", run_id, ["missing_in_mysql"]) == ["abc"]
+
+
+def test_id_sort_key_orders_numbers_numerically():
+    object_id = ObjectId("000000000000000000000000")
+
+    assert sorted([10, "b", 2, object_id, 1.0], key=id_sort_key) == [1.0, 2, 10, object_id, "b"]
@@ -0,0 +1,22 @@
+from app.routers.v1.utils import chunked, chunked_groups
+
+
+def test_chunked_splits_without_materializing():
+    assert list(chunked(iter(range(5)), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+def test_chunked_groups_never_splits_a_group():
+    groups = [[1, 2], [3], [4, 5, 6], [7], [8, 9]]
+
+    chunks = list(chunked_groups(groups, 3))
+
+    assert chunks == [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    for group in groups:
+        assert any(set(group) <= set(chunk) for chunk in chunks)
+
+
+def test_chunked_groups_gives_a_large_group_its_own_chunk():
+    chunks = list(chunked_groups([[1], [2, 3, 4, 5], [6]], 3))
+
+    assert chunks == [[1], [2, 3, 4, 5], [6]]